@@ -0,0 +1,246 @@
+"""Admission control for API requests.
+
+Two gates run before a request reaches a route:
+
+* a token bucket per client refilled at ADMISSION_RATE requests per second
+  with ADMISSION_BURST headroom; an empty bucket answers 429. Clients are
+  told apart by IP, or by the ADMISSION_KEY_HEADER API key when it is one of
+  ADMISSION_API_KEYS. Nothing else validates keys, so an unknown key is
+  ignored rather than given a fresh bucket of its own;
+* a global limit of ADMISSION_MAX_CONCURRENCY requests in progress, with a
+  short FIFO queue behind it. Requests are shed with 503 straight away when
+  the queue is full or when the wait predicted from the recent service time
+  would exceed ADMISSION_QUEUE_SLO_MS, and also if they do wait that long.
+
+Both answers carry Retry-After. Cheap routes (ADMISSION_EXEMPT_PATHS) skip
+both gates, and the middleware sits inside ResponsePipelineMiddleware, so
+responses served from the encoded-response cache never reach it. A
+streamed response gives its concurrency slot back once streaming starts:
+live and batch streams are long-lived and bounded on their own.
+"""
+import os
+import json
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+
+from settings import env_float, env_int
+from metrics import registry
+
+admission_shed = registry.counter(
+    "admission_shed_total", "Requests rejected by admission control", ("reason",)
+)
+admission_queue_duration = registry.histogram(
+    "admission_queue_duration_seconds", "Time requests waited for a concurrency slot"
+)
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+
+
+class AdmissionController:
+    def __init__(self):
+        # 0 disables the per-client limit / the concurrency limit
+        self.rate = env_float("ADMISSION_RATE", 20)
+        self.burst = env_float("ADMISSION_BURST", max(1.0, self.rate * 2))
+        self.max_clients = env_int("ADMISSION_MAX_CLIENTS", 10000)
+        self.max_concurrency = env_int("ADMISSION_MAX_CONCURRENCY", 64)
+        self.max_queue = env_int("ADMISSION_MAX_QUEUE", 128)
+        self.queue_slo = env_float("ADMISSION_QUEUE_SLO_MS", 2000) / 1000
+        self.key_header = os.environ.get("ADMISSION_KEY_HEADER", "x-api-key").lower().encode("latin-1")
+        self.api_keys = {
+            key.strip().encode("latin-1")
+            for key in os.environ.get("ADMISSION_API_KEYS", "").split(",")
+            if key.strip()
+        }
+        self.exempt = {
+            path.strip()
+            for path in os.environ.get("ADMISSION_EXEMPT_PATHS", "/api/,/api/metrics,/api/upstream/stats").split(",")
+            if path.strip()
+        }
+        self.prefix = "/api/"
+        self._buckets = OrderedDict()
+        self._waiters = deque()
+        self.in_flight = 0
+        # Exponentially weighted mean of how long a request holds its slot
+        self.service_time = 0.05
+        self.admitted = 0
+        self.queued = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+        self.shed = {"rate_limited": 0, "queue_full": 0, "predicted_slo": 0, "queue_timeout": 0}
+
+    def applies_to(self, scope) -> bool:
+        path = scope["path"]
+        return path.startswith(self.prefix) and path not in self.exempt
+
+    def client_key(self, scope) -> str:
+        if self.api_keys:
+            for name, value in scope.get("headers", ()):
+                if name == self.key_header and value in self.api_keys:
+                    return "key:" + value.decode("latin-1")
+        client = scope.get("client")
+        return "ip:" + (client[0] if client else "unknown")
+
+    def take_token(self, key: str) -> float:
+        """0 if the client may proceed, else seconds until it has a token again"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.burst, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+            self._buckets.move_to_end(key)
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / self.rate
+
+    def predicted_wait(self) -> float:
+        """Queue wait a request arriving now should expect"""
+        return (len(self._waiters) + 1) * self.service_time / max(1, self.max_concurrency)
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.predicted_wait()))
+
+    async def acquire(self):
+        """Take a concurrency slot; returns the shed reason instead if there is none"""
+        if self.max_concurrency <= 0:
+            return None
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            return "queue_full"
+        if self.predicted_wait() > self.queue_slo:
+            return "predicted_slo"
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.queue_slo)
+        except asyncio.TimeoutError:
+            return "queue_timeout"
+        finally:
+            # Timed out or the client went away before a slot was handed over
+            if waiter.cancelled():
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+        waited = time.monotonic() - started
+        admission_queue_duration.observe(value=waited)
+        self.admitted += 1
+        self.queued += 1
+        self.queue_time_total += waited
+        self.queue_time_max = max(self.queue_time_max, waited)
+        return None
+
+    def release(self, held: float):
+        """Give a slot back after ``held`` seconds, handing it straight to the next live waiter"""
+        if self.max_concurrency <= 0:
+            return
+        self.service_time += 0.1 * (held - self.service_time)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)  # the slot changes hands, in_flight stays
+                return
+        self.in_flight -= 1
+
+    def record_shed(self, reason: str):
+        self.shed[reason] += 1
+        admission_shed.inc(reason)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queued_now": len(self._waiters),
+            "max_queue": self.max_queue,
+            "clients": len(self._buckets),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "queue_time_avg_ms": round(self.queue_time_total / self.queued * 1000, 1) if self.queued else 0.0,
+            "queue_time_max_ms": round(self.queue_time_max * 1000, 1),
+            "service_time_ms": round(self.service_time * 1000, 1),
+            "shed": dict(self.shed),
+        }
+
+
+async def _reject(send, status: int, detail: str, retry_after: int):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware applying per-client rate limits and the concurrency limit
+
+    It must sit inside ResponsePipelineMiddleware so cached responses are
+    served without taking a token or a slot.
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controller
+        if scope["type"] != "http" or not controller.applies_to(scope):
+            await self.app(scope, receive, send)
+            return
+
+        # Time spent queued here counts against the request's deadline
+        scope["received_at"] = time.monotonic()
+        wait = controller.take_token(controller.client_key(scope))
+        if wait > 0:
+            controller.record_shed("rate_limited")
+            await _reject(send, 429, "Too many requests", max(1, math.ceil(wait)))
+            return
+
+        reason = await controller.acquire()
+        if reason is not None:
+            controller.record_shed(reason)
+            await _reject(send, 503, "Server is busy, please retry shortly", controller.retry_after())
+            return
+
+        started = time.monotonic()
+        held = True
+
+        def release():
+            nonlocal held
+            if held:
+                held = False
+                controller.release(time.monotonic() - started)
+
+        async def send_releasing(message):
+            if message["type"] == "http.response.body" and message.get("more_body", False):
+                release()  # streaming has started; it is bounded by its own limits
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_releasing)
+        finally:
+            release()
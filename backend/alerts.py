@@ -0,0 +1,227 @@
+"""Config-driven weather alert rules evaluated with vectorized predicates.
+
+Rules live in ``data/alert_rules.json`` (or ALERT_RULES_PATH). Each rule has
+a list of conditions that must all hold: a threshold on a numeric field
+(``{"field": "wind_speed", "op": ">", "value": 15}``) or a weather id check
+(``{"field": "weather_id", "between": [200, 300]}`` or ``"in": [...]``).
+Thresholds are in the canonical metric units; payloads are converted for
+display only after evaluation.
+
+Rules are compiled once into functions over NumPy columns. A location's
+current conditions and its whole forecast become one table, and
+``evaluate_many`` stacks the tables of any number of locations so that
+every rule is a single array expression per batch. Matches on the current
+row produce the rule's ``current`` alert; forecast matches produce its
+``forecast`` alert (type ``<type>_forecast``). Forecast matches closer
+together than the dedupe window are merged into one alert, and a forecast
+run that starts within the window of an alert already in effect is dropped.
+"""
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from compact import as_compact
+from units import CANONICAL, format_speed, format_temperature
+
+DEFAULT_PATH = Path(__file__).parent / "data" / "alert_rules.json"
+
+# Column name -> how to read it from an OpenWeather current conditions payload;
+# forecasts are read from the CompactForecast column of the same name
+FIELDS = {
+    "weather_id": lambda item: item["weather"][0]["id"],
+    "temp": lambda item: item["main"]["temp"],
+    "feels_like": lambda item: item["main"]["feels_like"],
+    "humidity": lambda item: item["main"]["humidity"],
+    "pressure": lambda item: item["main"]["pressure"],
+    "wind_speed": lambda item: item["wind"]["speed"],
+    "wind_gust": lambda item: item["wind"].get("gust", item["wind"]["speed"]),
+    "clouds": lambda item: item["clouds"]["all"],
+    "visibility": lambda item: item.get("visibility", 10000),
+    "pop": lambda item: item.get("pop", 0),
+    "rain": lambda item: item.get("rain", {}).get("3h", item.get("rain", {}).get("1h", 0)),
+    "snow": lambda item: item.get("snow", {}).get("3h", item.get("snow", {}).get("1h", 0)),
+}
+
+OPERATORS = {
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "<": np.less,
+    "<=": np.less_equal,
+    "==": np.equal,
+}
+
+# The extreme of a run that is worth reporting for each comparison
+PEAKS = {
+    ">": np.maximum,
+    ">=": np.maximum,
+    "<": np.minimum,
+    "<=": np.minimum,
+}
+
+
+def _compile_condition(condition: dict):
+    field = condition.get("field")
+    if field not in FIELDS:
+        raise ValueError(f"Unknown alert field: {field}")
+    if "between" in condition:
+        low, high = condition["between"]
+        return field, lambda columns: (columns[field] >= low) & (columns[field] < high)
+    if "in" in condition:
+        values = np.array(condition["in"])
+        return field, lambda columns: np.isin(columns[field], values)
+    op = condition.get("op")
+    if op not in OPERATORS:
+        raise ValueError(f"Unknown alert operator: {op}")
+    compare = OPERATORS[op]
+    value = condition["value"]
+    return field, lambda columns: compare(columns[field], value)
+
+
+class Rule:
+    __slots__ = ("type", "icon", "current", "forecast", "fields", "predicates", "peak_field", "peak")
+
+    def __init__(self, config: dict):
+        self.type = config["type"]
+        self.icon = config.get("icon", "alert-triangle")
+        self.current = config.get("current")
+        self.forecast = config.get("forecast")
+        if not config.get("when"):
+            raise ValueError(f"Alert rule {self.type} has no conditions")
+        compiled = [_compile_condition(condition) for condition in config["when"]]
+        self.fields = {field for field, _ in compiled}
+        self.predicates = [predicate for _, predicate in compiled]
+        # The first threshold condition decides which value a forecast run reports
+        threshold = next((c for c in config["when"] if c.get("op") in PEAKS), None)
+        self.peak_field = threshold["field"] if threshold else None
+        self.peak = PEAKS[threshold["op"]] if threshold else None
+
+    def matches(self, columns: dict) -> np.ndarray:
+        mask = self.predicates[0](columns)
+        for predicate in self.predicates[1:]:
+            mask &= predicate(columns)
+        return mask
+
+
+class AlertEngine:
+    def __init__(self, rules: list, dedupe_window_hours: float = 6):
+        self.rules = rules
+        self.window = int(dedupe_window_hours * 3600)
+        self.fields = sorted({"temp", "wind_speed"} | {field for rule in rules for field in rule.fields})
+        self.evaluations = 0
+        self.locations = 0
+        self.rows = 0
+
+    @classmethod
+    def from_file(cls, path=None):
+        path = Path(path or os.environ.get("ALERT_RULES_PATH") or DEFAULT_PATH)
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        return cls([Rule(rule) for rule in config["rules"]], config.get("dedupe_window_hours", 6))
+
+    def _table(self, current: dict, forecast) -> dict:
+        table = {field: np.concatenate(([read(current)], getattr(forecast, field))).astype(np.float64)
+                 for field, read in FIELDS.items() if field in self.fields}
+        table["dt"] = np.concatenate(([current["dt"]], forecast.dt)).astype(np.int64)
+        return table
+
+    def evaluate(self, current: dict, forecast, units: str = CANONICAL) -> dict:
+        return self.evaluate_many([(current, forecast)], units)[0]
+
+    def evaluate_many(self, locations: list, units: str = CANONICAL) -> list:
+        """Alerts for many (current, forecast) pairs in one vectorized pass
+
+        Forecasts may be raw payloads or CompactForecasts.
+        """
+        if not locations:
+            return []
+        locations = [(current, as_compact(forecast)) for current, forecast in locations]
+        tables = [self._table(current, forecast) for current, forecast in locations]
+        sizes = np.array([len(table["dt"]) for table in tables], dtype=np.int64)
+        offsets = np.r_[0, np.cumsum(sizes)[:-1]]
+        columns = {name: np.concatenate([table[name] for table in tables]) for name in tables[0]}
+        location = np.repeat(np.arange(len(tables)), sizes)
+        is_current = np.zeros(len(location), dtype=bool)
+        is_current[offsets] = True
+        now = columns["dt"][offsets]
+        tz = [current.get("timezone", forecast.timezone) for current, forecast in locations]
+
+        results = [{"current": [], "forecast": []} for _ in locations]
+        for rule in self.rules:
+            mask = rule.matches(columns)
+            fired_now = mask[offsets]
+            if rule.current is not None:
+                for i in np.flatnonzero(fired_now):
+                    results[i]["current"].append(
+                        self._alert(rule, rule.current, rule.type, columns, offsets[i], None, tz[i], units)
+                    )
+            if rule.forecast is None:
+                continue
+            rows = np.flatnonzero(mask & ~is_current)
+            if not len(rows):
+                continue
+            row_location = location[rows]
+            dt = columns["dt"][rows]
+            # A new run starts at a new location or after a gap longer than the window
+            starts = np.flatnonzero(np.r_[True, (row_location[1:] != row_location[:-1])
+                                          | (np.diff(dt) > self.window)])
+            ends = np.r_[starts[1:], len(rows)] - 1
+            peaks = rule.peak.reduceat(columns[rule.peak_field][rows], starts) if rule.peak else None
+            for n, (start, end) in enumerate(zip(starts, ends)):
+                i = row_location[start]
+                if fired_now[i] and rule.current is not None and dt[start] - now[i] <= self.window:
+                    continue  # the same event is already reported as in effect
+                alert = self._alert(rule, rule.forecast, f"{rule.type}_forecast", columns, rows[start],
+                                    (rule.peak_field, peaks[n]) if peaks is not None else None, tz[i], units)
+                alert["start"] = int(dt[start])
+                alert["end"] = int(dt[end])
+                results[i]["forecast"].append(alert)
+
+        self.evaluations += 1
+        self.locations += len(locations)
+        self.rows += len(location)
+        output = []
+        for result in results:
+            alerts = result["current"] + sorted(result["forecast"], key=lambda alert: alert["start"])
+            output.append({
+                "alerts": alerts,
+                "count": len(alerts),
+                "has_warnings": any(alert["severity"] == "warning" for alert in alerts),
+            })
+        return output
+
+    @staticmethod
+    def _alert(rule: Rule, message: dict, alert_type: str, columns: dict, row: int, peak, tz: int, units: str) -> dict:
+        values = {
+            "temp": columns["temp"][row],
+            "wind_speed": columns["wind_speed"][row],
+        }
+        if peak is not None and peak[0] in values:
+            values[peak[0]] = peak[1]
+        local = datetime.fromtimestamp(int(columns["dt"][row]) + tz, timezone.utc)
+        description = message["description"].format(
+            temp=format_temperature(values["temp"], units),
+            wind_speed=format_speed(values["wind_speed"], units),
+            # Forecast alerts span five days, so the time carries the local date
+            time=local.strftime("%a %d %b, %I:%M %p"),
+        )
+        return {
+            "type": alert_type,
+            "severity": message["severity"],
+            "title": message["title"],
+            "description": description,
+            "icon": rule.icon,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "rules": len(self.rules),
+            "evaluations": self.evaluations,
+            "locations": self.locations,
+            "rows": self.rows,
+        }
+
+
+alert_engine = AlertEngine.from_file()
@@ -0,0 +1,94 @@
+"""Per-endpoint circuit breakers for upstream calls.
+
+A breaker opens after BREAKER_FAILURES consecutive failures, where a call
+slower than BREAKER_SLOW_CALL seconds counts as a failure too. While open,
+calls fail fast instead of waiting on a sick upstream. After
+BREAKER_OPEN_SECONDS it lets a single probe through (half-open); the probe's
+outcome closes the breaker again or re-opens it.
+"""
+import time
+
+from settings import env_float, env_int
+from upstream import endpoint_name
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int, slow_call: float, open_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.rejected = 0
+        self.trips = 0
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        self.rejected += 1
+        return False
+
+    def abandon(self):
+        """The allowed call never reached upstream; let another probe through"""
+        if self.state == HALF_OPEN:
+            self.probing = False
+
+    def retry_after(self) -> float:
+        return max(1.0, self.open_seconds - (time.monotonic() - self.opened_at))
+
+    def record(self, success: bool, latency: float):
+        if success and latency <= self.slow_call:
+            self.failures = 0
+            self.probing = False
+            self.state = CLOSED
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.trips += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+            self.probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+class BreakerRegistry:
+    def __init__(self):
+        self.failure_threshold = env_int("BREAKER_FAILURES", 5)
+        self.slow_call = env_float("BREAKER_SLOW_CALL", 5.0)
+        self.open_seconds = env_float("BREAKER_OPEN_SECONDS", 30.0)
+        self._breakers = {}
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        name = endpoint_name(endpoint)
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, self.failure_threshold, self.slow_call, self.open_seconds)
+            self._breakers[name] = breaker
+        return breaker
+
+    def stats(self) -> dict:
+        return {name: breaker.stats() for name, breaker in self._breakers.items()}
+
+
+upstream_breakers = BreakerRegistry()
@@ -0,0 +1,295 @@
+"""Caches for upstream weather responses.
+
+L1 is an in-process cache: entries expire after a per-endpoint TTL and the
+least recently used ones are evicted once the cache grows past its memory
+budget. Coordinates are snapped to a grid before keying so that nearby
+lookups share one entry. Expired entries are kept for CACHE_MAX_STALE more
+seconds as a last known good copy for stale-while-revalidate.
+
+L2 is a MongoDB collection shared by every worker, so a payload fetched by
+one process warms all the others and survives restarts.
+"""
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from settings import env_bool, env_float, env_float_map, env_int
+from upstream import endpoint_name
+from response_pipeline import dumps
+from request_context import time_left
+
+logger = logging.getLogger(__name__)
+
+# Seconds an upstream payload stays fresh. Current conditions change within
+# minutes, forecasts are refreshed upstream every few hours and place names
+# practically never change. Override with e.g. CACHE_TTLS="weather=300".
+DEFAULT_TTLS = {
+    "weather": 600,
+    "forecast": 3600,
+    "air_pollution": 1800,
+    "direct": 30 * 86400,
+    "reverse": 30 * 86400,
+}
+
+
+def snap(value: float, grid: float) -> float:
+    """Round a coordinate to the nearest grid point"""
+    if grid <= 0:
+        return value
+    return round(round(value / grid) * grid, 6)
+
+
+class CacheEntry:
+    __slots__ = ("value", "stored_at", "expires_at", "stale_until", "size", "version")
+
+    def __init__(self, value, stored_at: float, expires_at: float, stale_until: float, size: int, version: int):
+        self.value = value
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.size = size
+        self.version = version
+
+
+class ResponseCache:
+    def __init__(self):
+        self.max_bytes = env_int("CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        self.grid = env_float("CACHE_GRID_DEG", 0.01)
+        self.ttls = env_float_map("CACHE_TTLS", DEFAULT_TTLS)
+        self.default_ttl = env_float("CACHE_DEFAULT_TTL", 300)
+        self.max_stale = env_float("CACHE_MAX_STALE", 6 * 3600)
+        self._entries = OrderedDict()
+        self._version = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def normalize(self, params: dict) -> dict:
+        """Snap lat/lon to the cache grid; the snapped values are sent upstream"""
+        normalized = dict(params)
+        for field in ("lat", "lon"):
+            if field in normalized:
+                normalized[field] = snap(float(normalized[field]), self.grid)
+        return normalized
+
+    def make_key(self, endpoint: str, params: dict) -> str:
+        parts = []
+        for name in sorted(params):
+            value = params[name]
+            if name == "q":
+                value = str(value).strip().lower()
+            parts.append(f"{name}={value}")
+        return f"{endpoint_name(endpoint)}?{'&'.join(parts)}"
+
+    def ttl_for(self, endpoint: str) -> float:
+        return self.ttls.get(endpoint_name(endpoint), self.default_ttl)
+
+    def get(self, key: str):
+        """Fresh value for the key, or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        now = time.monotonic()
+        if entry.expires_at <= now:
+            if entry.stale_until <= now:
+                self._remove(key)
+                self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def get_stale(self, key: str):
+        """(value, age_seconds) for an expired entry still within its stale window, or None"""
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is None or entry.stale_until <= now:
+            return None
+        self._entries.move_to_end(key)
+        self.stale_hits += 1
+        return entry.value, now - entry.stored_at
+
+    def version(self, key: str):
+        """Version of the fresh entry for the key (changes on every set), or None"""
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        return entry.version
+
+    def ttl_left(self, key: str):
+        """Seconds until the entry expires, or None if it is not cached"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return entry.expires_at - time.monotonic()
+
+    def set(self, key: str, value, ttl: float, age: float = 0.0):
+        if ttl + self.max_stale <= 0:
+            return
+        # Compact entries know their own size; for plain payloads the
+        # serialized length is a cheap, stable proxy for the memory they hold
+        memory_size = getattr(value, "memory_size", None)
+        size = len(key) + (memory_size() if memory_size is not None else len(dumps(value)))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        now = time.monotonic()
+        self._version += 1
+        self._entries[key] = CacheEntry(value, now - age, now + ttl, now + ttl + self.max_stale, size, self._version)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "grid_deg": self.grid,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stale_hits": self.stale_hits,
+            "max_stale": self.max_stale,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+def _aware(value: datetime) -> datetime:
+    # Motor returns naive UTC datetimes unless the client is tz_aware
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+class MongoResponseCache:
+    def __init__(self, collection):
+        self.collection = collection
+        self.enabled = env_bool("CACHE_L2_ENABLED", True)
+        # Mongo is an optimisation here; never let a slow database stall a request
+        self.timeout = env_float("CACHE_L2_TIMEOUT", 0.5)
+        # After a failure, skip reads for a while instead of paying the timeout on every miss
+        self.backoff = env_float("CACHE_L2_BACKOFF", 30)
+        self._skip_until = 0.0
+        self._pending = set()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    async def ensure_indexes(self):
+        if not self.enabled:
+            return
+        # expireAfterSeconds=0 lets Mongo drop documents at their own expires_at
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        await self.collection.create_index([("endpoint", 1), ("lat", 1), ("lon", 1), ("units", 1)])
+
+    async def get(self, key: str):
+        """Return (payload, fresh_seconds_left, age_seconds), or None
+
+        fresh_seconds_left goes negative once the payload is only good as a
+        stale fallback.
+        """
+        if not self.enabled or time.monotonic() < self._skip_until:
+            return None
+        now = datetime.now(timezone.utc)
+        timeout = self.timeout
+        remaining = time_left()
+        # A request with little time left waits less, but that says nothing about Mongo
+        limited = remaining is not None and remaining < timeout
+        if limited:
+            timeout = max(0.0, remaining)
+        try:
+            doc = await asyncio.wait_for(
+                self.collection.find_one(
+                    {"_id": key, "expires_at": {"$gt": now}},
+                    {"payload": 1, "stored_at": 1, "fresh_until": 1, "expires_at": 1}
+                ),
+                timeout
+            )
+        except asyncio.TimeoutError:
+            if limited:
+                self.misses += 1
+                return None
+            self.errors += 1
+            self._skip_until = time.monotonic() + self.backoff
+            logger.warning(f"L2 cache read timed out for {key}")
+            return None
+        except Exception as e:
+            self.errors += 1
+            self._skip_until = time.monotonic() + self.backoff
+            logger.warning(f"L2 cache read failed for {key}: {e!r}")
+            return None
+        if doc is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        fresh_until = _aware(doc.get("fresh_until", doc["expires_at"]))
+        age = (now - _aware(doc.get("stored_at", now))).total_seconds()
+        return doc["payload"], (fresh_until - now).total_seconds(), age
+
+    def put(self, key: str, endpoint: str, params: dict, payload, ttl: float, max_stale: float = 0.0):
+        """Write a payload back in the background; the caller never waits on it"""
+        if not self.enabled or ttl <= 0:
+            return
+        task = asyncio.ensure_future(self._put(key, endpoint, params, payload, ttl, max_stale))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _put(self, key: str, endpoint: str, params: dict, payload, ttl: float, max_stale: float):
+        now = datetime.now(timezone.utc)
+        fresh_until = now + timedelta(seconds=ttl)
+        doc = {
+            "endpoint": endpoint_name(endpoint),
+            "lat": params.get("lat"),
+            "lon": params.get("lon"),
+            "units": params.get("units"),
+            "payload": payload,
+            "stored_at": now,
+            "fresh_until": fresh_until,
+            # Mongo drops the document once it is too old even as a stale fallback
+            "expires_at": fresh_until + timedelta(seconds=max_stale),
+        }
+        try:
+            await self.collection.replace_one({"_id": key}, doc, upsert=True)
+            self.writes += 1
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"L2 cache write failed for {key}: {e!r}")
+
+    async def drain(self):
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "writes": self.writes,
+            "errors": self.errors,
+            "pending_writes": len(self._pending),
+        }
+
+
+response_cache = ResponseCache()
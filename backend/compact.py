@@ -0,0 +1,150 @@
+"""Compact in-memory representation of cached forecast payloads.
+
+An OpenWeather forecast is 40 items, each a dict with four nested dicts, so
+a raw cached forecast costs tens of kilobytes of Python objects. The L1
+cache keeps a CompactForecast instead: one typed NumPy column per field
+(small integer fields such as humidity and clouds as int16) and the weather
+``main``/``description`` strings as codes into one interned string table
+(icons use forecast_agg's icon codes, so daily aggregation reads the column
+as is). Builders read the columns directly and response JSON is
+materialized only when a section is built.
+
+Only the L1 copy is compacted; the shared Mongo cache keeps the raw payload.
+"""
+import sys
+
+import numpy as np
+
+from forecast_agg import icon_code, icon_name
+from upstream import endpoint_name
+
+# Interned weather labels ("Rain", "light rain", ...) shared by every entry
+_label_codes = {}
+_labels = []
+
+
+def label_code(label: str) -> int:
+    code = _label_codes.get(label)
+    if code is None:
+        code = len(_labels)
+        label = sys.intern(label)
+        _label_codes[label] = code
+        _labels.append(label)
+    return code
+
+
+def _column(values, dtype) -> np.ndarray:
+    column = np.array(values, dtype=dtype)
+    column.flags.writeable = False
+    return column
+
+
+class CompactForecast:
+    __slots__ = (
+        "dt", "temp", "feels_like", "temp_min", "temp_max", "humidity", "pressure",
+        "wind_speed", "wind_deg", "wind_gust", "clouds", "visibility", "pop", "rain", "snow",
+        "weather_id", "main", "description", "icon", "city", "timezone",
+    )
+
+    def __init__(self, payload: dict):
+        items = payload.get("list", [])
+        mains = [item["main"] for item in items]
+        winds = [item["wind"] for item in items]
+        weathers = [item["weather"][0] for item in items]
+        self.dt = _column([item["dt"] for item in items], np.int64)
+        self.temp = _column([main["temp"] for main in mains], np.float64)
+        self.feels_like = _column([main["feels_like"] for main in mains], np.float64)
+        self.temp_min = _column([main["temp_min"] for main in mains], np.float64)
+        self.temp_max = _column([main["temp_max"] for main in mains], np.float64)
+        self.humidity = _column([main["humidity"] for main in mains], np.int16)
+        self.pressure = _column([main["pressure"] for main in mains], np.int32)
+        self.wind_speed = _column([wind["speed"] for wind in winds], np.float64)
+        self.wind_deg = _column([wind.get("deg", 0) for wind in winds], np.int16)
+        self.wind_gust = _column([wind.get("gust", wind["speed"]) for wind in winds], np.float64)
+        self.clouds = _column([item["clouds"]["all"] for item in items], np.int16)
+        self.visibility = _column([item.get("visibility", 10000) for item in items], np.int32)
+        self.pop = _column([item.get("pop", 0) for item in items], np.float64)
+        self.rain = _column([item.get("rain", {}).get("3h", 0) for item in items], np.float64)
+        self.snow = _column([item.get("snow", {}).get("3h", 0) for item in items], np.float64)
+        self.weather_id = _column([weather["id"] for weather in weathers], np.int16)
+        self.main = _column([label_code(weather["main"]) for weather in weathers], np.int32)
+        self.description = _column([label_code(weather["description"]) for weather in weathers], np.int32)
+        self.icon = _column([icon_code(weather["icon"]) for weather in weathers], np.int32)
+        self.city = payload.get("city", {})
+        self.timezone = self.city.get("timezone", 0)
+
+    def __len__(self) -> int:
+        return len(self.dt)
+
+    def daily_columns(self) -> dict:
+        """Columns in the shape forecast_agg.aggregate_daily expects"""
+        return {
+            "dt": self.dt,
+            "temp": self.temp,
+            "humidity": self.humidity.astype(np.float64),
+            "pop": self.pop,
+            "precip": self.rain + self.snow,
+            "icon": self.icon,
+        }
+
+    def hourly(self, limit: int = None) -> list:
+        """Materialize the first ``limit`` items as the forecast route's hourly dicts"""
+        stop = len(self) if limit is None else min(limit, len(self))
+        columns = zip(*(
+            getattr(self, name)[:stop].tolist() for name in (
+                "dt", "temp", "feels_like", "temp_min", "temp_max", "humidity", "pressure",
+                "wind_speed", "wind_deg", "clouds", "pop", "rain", "snow",
+                "weather_id", "main", "description", "icon",
+            )
+        ))
+        return [
+            {
+                "dt": dt,
+                "temp": temp,
+                "feels_like": feels_like,
+                "temp_min": temp_min,
+                "temp_max": temp_max,
+                "humidity": humidity,
+                "pressure": pressure,
+                "wind_speed": wind_speed,
+                "wind_deg": wind_deg,
+                "clouds": clouds,
+                "pop": pop,  # Probability of precipitation
+                "rain": rain,
+                "snow": snow,
+                "weather": {
+                    "id": weather_id,
+                    "main": _labels[main],
+                    "description": _labels[description],
+                    "icon": icon_name(icon),
+                },
+            }
+            for (dt, temp, feels_like, temp_min, temp_max, humidity, pressure, wind_speed, wind_deg,
+                 clouds, pop, rain, snow, weather_id, main, description, icon) in columns
+        ]
+
+    def memory_size(self) -> int:
+        """Approximate bytes held by this entry, for the cache's memory budget"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.city)
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, np.ndarray):
+                size += sys.getsizeof(value)
+        return size
+
+
+def as_compact(forecast) -> CompactForecast:
+    return forecast if isinstance(forecast, CompactForecast) else CompactForecast(forecast)
+
+
+# Endpoint name -> compact representation kept in L1
+COMPACTORS = {
+    "forecast": CompactForecast,
+}
+
+
+def compact_payload(endpoint: str, payload):
+    compactor = COMPACTORS.get(endpoint_name(endpoint))
+    if compactor is None or not isinstance(payload, dict):
+        return payload
+    return compactor(payload)
@@ -0,0 +1,75 @@
+"""Columnar daily aggregation of 3-hourly forecasts.
+
+Forecasts arrive as NumPy columns (CompactForecast.daily_columns) and every
+daily statistic is computed with grouped reductions instead of per-item
+Python loops. Days are split on the location's own midnight (OpenWeather's
+``city.timezone`` offset), not the server's.
+"""
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+
+# Icons are stored as small integer codes so the daily mode is a bincount
+_icon_codes = {}
+_icons = []
+
+
+def icon_code(icon: str) -> int:
+    code = _icon_codes.get(icon)
+    if code is None:
+        code = len(_icons)
+        _icon_codes[icon] = code
+        _icons.append(icon)
+    return code
+
+
+def icon_name(code: int) -> str:
+    return _icons[code]
+
+
+def aggregate_daily(columns: dict, tz_offset: int = 0, max_days: int = 5) -> list:
+    """Daily summaries for one location"""
+    local_day = (columns["dt"] + tz_offset) // SECONDS_PER_DAY
+    # Forecast items are in time order, but sort anyway so each day is contiguous
+    order = np.argsort(local_day, kind="stable")
+    local_day = local_day[order]
+    if not len(local_day):
+        return []
+    starts = np.flatnonzero(np.r_[True, local_day[1:] != local_day[:-1]])
+    # Only the first max_days days are summarized
+    stop = starts[max_days] if len(starts) > max_days else len(local_day)
+    starts = starts[:max_days]
+    counts = np.diff(np.r_[starts, stop])
+
+    temp = columns["temp"][order][:stop]
+    humidity = columns["humidity"][order][:stop]
+    pop = columns["pop"][order][:stop]
+    precip = columns["precip"][order][:stop]
+    icon = columns["icon"][order][:stop]
+
+    temp_min = np.minimum.reduceat(temp, starts)
+    temp_max = np.maximum.reduceat(temp, starts)
+    temp_avg = np.add.reduceat(temp, starts) / counts
+    humidity_avg = np.add.reduceat(humidity, starts) / counts
+    pop_max = np.maximum.reduceat(pop, starts)
+    precip_total = np.add.reduceat(precip, starts)
+
+    # Most common icon per day: count (day, icon) pairs, then argmax per row
+    group = np.repeat(np.arange(len(starts)), counts)
+    icon_counts = np.bincount(group * len(_icons) + icon, minlength=len(starts) * len(_icons))
+    dominant_icon = icon_counts.reshape(len(starts), len(_icons)).argmax(axis=1)
+
+    dates = local_day[starts].astype("datetime64[D]").astype(str)
+    return [
+        {
+            "date": str(dates[g]),
+            "temp_min": float(temp_min[g]),
+            "temp_max": float(temp_max[g]),
+            "temp_avg": round(float(temp_avg[g]), 2),
+            "humidity_avg": float(humidity_avg[g]),
+            "pop_max": float(pop_max[g]),
+            "precipitation": round(float(precip_total[g]), 2),
+            "icon": _icons[dominant_icon[g]],
+        }
+        for g in range(len(starts))
+    ]
@@ -0,0 +1,216 @@
+"""Local city gazetteer for geocode autocomplete and reverse geocoding.
+
+Cities are loaded from a tab-separated file (the bundled ``data/cities.tsv``
+or a GeoNames ``cities*.txt`` dump via GAZETTEER_PATH) into a sorted array of
+normalized names, so a prefix lookup is two bisects plus a small ranking
+step. Matching ignores case and diacritics ("sao" finds "São Paulo").
+
+The same places are bucketed into a lat/lon grid so the nearest city to a
+coordinate is found by scanning only the handful of cells around it.
+"""
+import os
+import math
+import bisect
+import heapq
+import logging
+import unicodedata
+from pathlib import Path
+
+from settings import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = Path(__file__).parent / "data" / "cities.tsv"
+
+
+def normalize_name(text: str) -> str:
+    """Lowercase, strip diacritics and collapse separators"""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    cleaned = "".join(ch if ch.isalnum() else " " for ch in stripped.casefold())
+    return " ".join(cleaned.split())
+
+
+class Place:
+    __slots__ = ("name", "country", "state", "lat", "lon", "population")
+
+    def __init__(self, name: str, country: str, state, lat: float, lon: float, population: int = 0):
+        self.name = name
+        self.country = country
+        self.state = state or None
+        self.lat = lat
+        self.lon = lon
+        self.population = population
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "lat": self.lat,
+            "lon": self.lon,
+            "country": self.country,
+            "state": self.state,
+        }
+
+
+def _read_places(path: Path):
+    with open(path, encoding="utf-8") as f:
+        header = None
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if header is None and fields[0] == "name":
+                header = fields
+                continue
+            if header is not None:
+                row = dict(zip(header, fields))
+                yield Place(
+                    row["name"], row["country"], row.get("state"),
+                    float(row["lat"]), float(row["lon"]), int(row.get("population") or 0)
+                )
+            elif len(fields) >= 15:
+                # GeoNames dump: name=1, lat=4, lon=5, country=8, population=14
+                yield Place(
+                    fields[1], fields[8], None,
+                    float(fields[4]), float(fields[5]), int(fields[14] or 0)
+                )
+
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class Gazetteer:
+    def __init__(self):
+        self.min_local_results = env_int("GAZETTEER_MIN_RESULTS", 1)
+        self.max_reverse_km = env_float("REVERSE_GEOCODE_MAX_KM", 15.0)
+        self.cell_deg = env_float("GAZETTEER_CELL_DEG", 0.5)
+        self._keys = []
+        self._places = []
+        self._seen = set()
+        self._cells = {}
+        self.loaded = 0
+        self.learned = 0
+        self.local_hits = 0
+        self.fallbacks = 0
+        self.reverse_local_hits = 0
+        self.reverse_fallbacks = 0
+
+    def load(self, path=None):
+        path = Path(path or os.environ.get("GAZETTEER_PATH") or DEFAULT_PATH)
+        if not path.exists():
+            logger.warning(f"Gazetteer file {path} not found, geocoding will use upstream only")
+            return
+        rows = []
+        seen = set()
+        for place in _read_places(path):
+            identity = self._identity(place)
+            if identity in seen:
+                continue
+            seen.add(identity)
+            rows.append((normalize_name(place.name), place))
+        # Bulk build: one sort instead of an insort per row
+        rows.sort(key=lambda row: row[0])
+        self._keys = [key for key, _ in rows]
+        self._places = [place for _, place in rows]
+        self._seen = seen
+        self._cells = {}
+        for place in self._places:
+            self._cells.setdefault(self._cell(place.lat, place.lon), []).append(place)
+        self.loaded = len(rows)
+        logger.info(f"Gazetteer loaded {self.loaded} places from {path}")
+
+    @staticmethod
+    def _identity(place: Place):
+        return (normalize_name(place.name), place.country, round(place.lat, 2), round(place.lon, 2))
+
+    def add(self, place: Place) -> bool:
+        """Learn a place (e.g. from an upstream result); returns False if already known"""
+        identity = self._identity(place)
+        if identity in self._seen:
+            return False
+        self._seen.add(identity)
+        key = normalize_name(place.name)
+        index = bisect.bisect_right(self._keys, key)
+        self._keys.insert(index, key)
+        self._places.insert(index, place)
+        self._cells.setdefault(self._cell(place.lat, place.lon), []).append(place)
+        self.learned += 1
+        return True
+
+    def _cell(self, lat: float, lon: float):
+        columns = max(1, round(360 / self.cell_deg))
+        return (math.floor(lat / self.cell_deg), math.floor((lon + 180) / self.cell_deg) % columns)
+
+    def nearest(self, lat: float, lon: float, max_km=None):
+        """Closest known place within max_km of the coordinate, or None"""
+        max_km = self.max_reverse_km if max_km is None else max_km
+        if max_km <= 0:
+            return None
+        # Cells to scan in each direction; longitude cells shrink towards the poles
+        lat_span = math.ceil(max_km / (111.0 * self.cell_deg))
+        cos_lat = max(math.cos(math.radians(min(abs(lat) + lat_span * self.cell_deg, 89.0))), 0.01)
+        columns = max(1, round(360 / self.cell_deg))
+        lon_span = min(math.ceil(max_km / (111.0 * self.cell_deg * cos_lat)), columns // 2)
+        row, column = self._cell(lat, lon)
+
+        best = None
+        best_km = max_km
+        for d_row in range(-lat_span, lat_span + 1):
+            for d_column in range(-lon_span, lon_span + 1):
+                for place in self._cells.get((row + d_row, (column + d_column) % columns), ()):
+                    km = haversine_km(lat, lon, place.lat, place.lon)
+                    if km <= best_km:
+                        best = place
+                        best_km = km
+        return best
+
+    def search(self, query: str, limit: int = 5) -> list:
+        """Prefix search; accepts OpenWeather style "city[,state][,country]" queries"""
+        parts = [part.strip() for part in query.split(",")]
+        prefix = normalize_name(parts[0])
+        if not prefix:
+            return []
+        country = None
+        state = None
+        if len(parts) > 1 and len(parts[-1]) == 2:
+            country = parts[-1].upper()
+        if len(parts) > 2 or (len(parts) == 2 and country is None):
+            state = normalize_name(parts[1])
+
+        lo = bisect.bisect_left(self._keys, prefix)
+        hi = bisect.bisect_left(self._keys, prefix + "\uffff", lo)
+        candidates = []
+        for index in range(lo, hi):
+            place = self._places[index]
+            if country and place.country != country:
+                continue
+            if state and not normalize_name(place.state or "").startswith(state):
+                continue
+            # Exact name matches first, then the most populous places
+            candidates.append((self._keys[index] == prefix, place.population, -index))
+        best = heapq.nlargest(limit, candidates)
+        return [self._places[-neg_index].to_dict() for _, _, neg_index in best]
+
+    def stats(self) -> dict:
+        return {
+            "places": len(self._places),
+            "loaded": self.loaded,
+            "learned": self.learned,
+            "local_hits": self.local_hits,
+            "upstream_fallbacks": self.fallbacks,
+            "reverse_local_hits": self.reverse_local_hits,
+            "reverse_upstream_fallbacks": self.reverse_fallbacks,
+            "max_reverse_km": self.max_reverse_km,
+        }
+
+
+gazetteer = Gazetteer()
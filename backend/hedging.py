@@ -0,0 +1,121 @@
+"""Hedged upstream requests.
+
+With HEDGE_ENABLED, an upstream call that has not answered within the
+observed HEDGE_PERCENTILE latency of its endpoint gets a duplicate request.
+The first usable answer wins and the other request is cancelled. An answer
+the caller's ``usable`` check rejects (e.g. a 5xx) counts as a failure and
+is returned only if the other request fails too. Latencies are tracked over
+the last HEDGE_WINDOW successful calls per endpoint, and nothing is hedged
+until HEDGE_MIN_SAMPLES of them have been seen.
+
+Hedges cost upstream quota like any other call. The caller passes in how to
+pay for one, and the server takes the token at background priority, so a
+hedge is skipped rather than queued or allowed into the reserve kept for
+user requests.
+"""
+import time
+import asyncio
+from collections import deque
+
+import numpy as np
+
+from settings import env_bool, env_float, env_int
+
+
+class Hedger:
+    def __init__(self):
+        self.enabled = env_bool("HEDGE_ENABLED", False)
+        self.percentile = env_float("HEDGE_PERCENTILE", 95)
+        self.window = env_int("HEDGE_WINDOW", 200)
+        self.min_samples = env_int("HEDGE_MIN_SAMPLES", 20)
+        self.min_delay = env_float("HEDGE_MIN_DELAY_MS", 50) / 1000
+        self._latencies = {}
+        self.sent = 0
+        self.won = 0
+        self.skipped = 0
+
+    def observe(self, name: str, seconds: float):
+        latencies = self._latencies.get(name)
+        if latencies is None:
+            latencies = self._latencies[name] = deque(maxlen=self.window)
+        latencies.append(seconds)
+
+    def delay_for(self, name: str):
+        """Seconds to wait before hedging a call to this endpoint, or None"""
+        latencies = self._latencies.get(name)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, float(np.percentile(latencies, self.percentile)))
+
+    async def run(self, name: str, call, pay_for_hedge, time_left=None, usable=None):
+        """Await ``call()``, racing a second ``call()`` if the first is slow
+
+        ``pay_for_hedge`` is awaited before the duplicate is sent and returns
+        False if there is no quota for it. ``time_left`` (seconds, or None)
+        skips hedges that could not finish before the request's deadline.
+        ``usable(result)`` decides whether a result may win the race.
+        """
+        if not self.enabled:
+            return await call()
+        delay = self.delay_for(name)
+        started = time.monotonic()
+        if delay is None or (time_left is not None and time_left <= delay):
+            result = await call()
+            self.observe(name, time.monotonic() - started)
+            return result
+
+        first = asyncio.ensure_future(call())
+        second = None
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                result = first.result()
+                self.observe(name, time.monotonic() - started)
+                return result
+            if not await pay_for_hedge():
+                self.skipped += 1
+                result = await first
+                self.observe(name, time.monotonic() - started)
+                return result
+            self.sent += 1
+            second = asyncio.ensure_future(call())
+            pending = {first, second}
+            error = None
+            rejected = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                    elif usable is not None and not usable(task.result()):
+                        rejected = rejected or task
+                    else:
+                        if task is second:
+                            self.won += 1
+                        self.observe(name, time.monotonic() - started)
+                        return task.result()
+            # Both failed: an answer the caller can report beats an exception
+            if rejected is not None:
+                return rejected.result()
+            raise error
+        finally:
+            for task in (first, second):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "sent": self.sent,
+            "won": self.won,
+            "skipped": self.skipped,
+            "delays_ms": {
+                name: round(delay * 1000, 1)
+                for name in self._latencies
+                if (delay := self.delay_for(name)) is not None
+            },
+        }
+
+
+upstream_hedger = Hedger()
@@ -0,0 +1,129 @@
+"""Keyset pagination and streamed listings for timestamped collections.
+
+Pages are ordered newest first by (timestamp, id) and continue from an opaque
+cursor holding the last key of the previous page, so fetching page N costs
+an index seek instead of skipping N pages of documents. The cursor for the
+next page is returned in the X-Next-Cursor header and the documents are
+streamed as a JSON array straight from the Mongo cursor, each one encoded
+by the caller's ``serialize`` (so routes control which fields are exposed
+and how timestamps are written).
+
+Documents still waiting in a write-behind buffer are merged in, and rows
+whose timestamp is still a legacy ISO string (see migrations.py) sort after
+every native datetime, as they do in Mongo.
+"""
+import json
+import base64
+import binascii
+from datetime import datetime
+
+SORT = [("timestamp", -1), ("id", -1)]
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def bson_datetime(value: datetime) -> datetime:
+    """Truncate to the millisecond precision Mongo stores"""
+    return value.replace(microsecond=value.microsecond // 1000 * 1000)
+
+
+def sort_key(doc: dict) -> tuple:
+    timestamp = doc["timestamp"]
+    # BSON orders strings before dates, so legacy rows come last in a newest-first listing
+    return (isinstance(timestamp, datetime), timestamp, doc.get("id") or "")
+
+
+def encode_cursor(key: tuple) -> str:
+    is_date, timestamp, doc_id = key
+    payload = {"t": timestamp.isoformat() if is_date else timestamp, "d": is_date, "id": doc_id}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        timestamp = datetime.fromisoformat(payload["t"]) if payload["d"] else str(payload["t"])
+        return (bool(payload["d"]), timestamp, str(payload["id"]))
+    except (binascii.Error, ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+
+def _below(key: tuple) -> dict:
+    is_date, timestamp, doc_id = key
+    clauses = [{"timestamp": {"$lt": timestamp}}, {"timestamp": timestamp, "id": {"$lt": doc_id}}]
+    if is_date:
+        clauses.append({"timestamp": {"$type": "string"}})
+    return {"$or": clauses}
+
+
+def _at_or_above(key: tuple) -> dict:
+    is_date, timestamp, doc_id = key
+    clauses = [{"timestamp": {"$gt": timestamp}}, {"timestamp": timestamp, "id": {"$gte": doc_id}}]
+    if not is_date:
+        clauses.append({"timestamp": {"$type": "date"}})
+    return {"$or": clauses}
+
+
+class Page:
+    """One page of a listing: plan it with ``prepare``, then stream ``body``"""
+
+    def __init__(self, collection, pending: list, cursor, limit: int, serialize):
+        # serialize(doc) -> the JSON bytes of one row
+        self.collection = collection
+        self.serialize = serialize
+        self.after = decode_cursor(cursor) if cursor else None
+        self.limit = limit
+        self.pending = sorted(
+            (doc for doc in pending if self.after is None or sort_key(doc) < self.after),
+            key=sort_key, reverse=True
+        )
+        self.last = None
+        self.next_cursor = None
+
+    async def prepare(self):
+        """Find where the page ends with a key-only query the index covers"""
+        keys = await self.collection.find(
+            _below(self.after) if self.after else {}, {"_id": 0, "timestamp": 1, "id": 1}
+        ).sort(SORT).limit(self.limit + 1).to_list(self.limit + 1)
+        pending_ids = {doc["id"] for doc in self.pending}
+        merged = sorted(
+            [sort_key(doc) for doc in keys if doc["id"] not in pending_ids]
+            + [sort_key(doc) for doc in self.pending],
+            reverse=True
+        )
+        if merged:
+            self.last = merged[:self.limit][-1]
+        if len(merged) > self.limit:
+            self.next_cursor = encode_cursor(self.last)
+
+    async def body(self):
+        serialize = self.serialize
+        yield b"["
+        if self.last is None:
+            yield b"]"
+            return
+        conditions = [_at_or_above(self.last)]
+        if self.after:
+            conditions.append(_below(self.after))
+        pending = [doc for doc in self.pending if sort_key(doc) >= self.last]
+        pending_ids = {doc["id"] for doc in pending}
+        cursor = self.collection.find({"$and": conditions}, {"_id": 0}).sort(SORT).batch_size(min(self.limit, 500))
+        index = 0
+        separator = b""
+        async for doc in cursor:
+            if doc["id"] in pending_ids:
+                continue
+            key = sort_key(doc)
+            while index < len(pending) and sort_key(pending[index]) > key:
+                yield separator + serialize(pending[index])
+                separator = b","
+                index += 1
+            yield separator + serialize(doc)
+            separator = b","
+        for doc in pending[index:]:
+            yield separator + serialize(doc)
+            separator = b","
+        yield b"]"
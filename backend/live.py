@@ -0,0 +1,132 @@
+"""Live weather subscriptions with one shared poller per location.
+
+However many clients watch a location, a single background task polls it and
+fans each change out to every subscriber. Pollers start with the first
+subscriber and stop with the last. Subscribers get a full snapshot first and
+then only the fields that changed.
+"""
+import asyncio
+import logging
+
+from settings import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+
+def diff_sections(old: dict, new: dict) -> dict:
+    """Fields of each section that differ between two snapshots"""
+    changes = {}
+    for section, value in new.items():
+        previous = old.get(section)
+        if value == previous:
+            continue
+        if isinstance(value, dict) and isinstance(previous, dict):
+            changed = {key: item for key, item in value.items() if previous.get(key) != item}
+            changed.update({key: None for key in previous if key not in value})
+            changes[section] = changed
+        else:
+            changes[section] = value
+    return changes
+
+
+class Subscriber:
+    def __init__(self, poller, queue_size: int):
+        self.poller = poller
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def send(self, message: dict):
+        if self.queue.full():
+            # Slow consumer: its pending diffs are useless once one is lost, so
+            # replace the backlog with a single full snapshot to resync from
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = {"type": "snapshot", "data": self.poller.snapshot}
+        self.queue.put_nowait(message)
+
+
+class LocationPoller:
+    def __init__(self, hub, key, lat: float, lon: float, units: str):
+        self.hub = hub
+        self.key = key
+        self.lat = lat
+        self.lon = lon
+        self.units = units
+        self.subscribers = set()
+        self.snapshot = None
+        self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                snapshot = await self.hub.fetch_snapshot(self.lat, self.lon, self.units)
+            except Exception as e:
+                logger.warning(f"Live poll failed for {self.key}: {e!r}")
+                snapshot = None
+            if snapshot is not None:
+                self.publish(snapshot)
+            await asyncio.sleep(self.hub.interval)
+
+    def publish(self, snapshot: dict):
+        if self.snapshot is None:
+            message = {"type": "snapshot", "data": snapshot}
+        else:
+            changes = diff_sections(self.snapshot, snapshot)
+            if not changes:
+                return
+            message = {"type": "update", "data": changes}
+        self.snapshot = snapshot
+        self.hub.messages += 1
+        for subscriber in list(self.subscribers):
+            subscriber.send(message)
+
+
+class LiveHub:
+    def __init__(self, fetch_snapshot, snap):
+        self.fetch_snapshot = fetch_snapshot
+        self.snap = snap
+        self.interval = env_float("LIVE_POLL_INTERVAL", 60)
+        self.queue_size = env_int("LIVE_QUEUE_SIZE", 8)
+        self.heartbeat = env_float("LIVE_HEARTBEAT", 15)
+        self._pollers = {}
+        self.messages = 0
+        self.dropped = 0
+
+    def subscribe(self, lat: float, lon: float, units: str) -> Subscriber:
+        lat, lon = self.snap(lat, lon)
+        key = (lat, lon, units)
+        poller = self._pollers.get(key)
+        if poller is None:
+            poller = LocationPoller(self, key, lat, lon, units)
+            self._pollers[key] = poller
+            poller.task = asyncio.ensure_future(poller.run())
+        subscriber = Subscriber(poller, self.queue_size)
+        poller.subscribers.add(subscriber)
+        if poller.snapshot is not None:
+            subscriber.send({"type": "snapshot", "data": poller.snapshot})
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        poller = subscriber.poller
+        poller.subscribers.discard(subscriber)
+        self.dropped += subscriber.dropped
+        if not poller.subscribers:
+            poller.task.cancel()
+            if self._pollers.get(poller.key) is poller:
+                del self._pollers[poller.key]
+
+    async def stop(self):
+        tasks = [poller.task for poller in self._pollers.values()]
+        for task in tasks:
+            task.cancel()
+        self._pollers.clear()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "pollers": len(self._pollers),
+            "subscribers": sum(len(poller.subscribers) for poller in self._pollers.values()),
+            "messages": self.messages,
+            "dropped": self.dropped,
+        }
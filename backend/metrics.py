@@ -0,0 +1,221 @@
+"""In-process metrics with a Prometheus text exposition.
+
+Recording is a dict lookup plus integer/float arithmetic: there are no locks
+because every metric is only updated from the event loop thread. Component
+stats that already exist (cache, quota, ...) are pulled in at scrape time by
+registered collectors instead of being double-counted on the hot path.
+"""
+import time
+import bisect
+
+from profiling import IO, span
+from request_context import within_deadline
+
+# Latency buckets in seconds, from cache hits (sub-ms) to upstream timeouts
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0)
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, _format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, *labels, value: float):
+        series = self._values.get(labels)
+        if series is None:
+            series = [0] * (len(self.buckets) + 1) + [0.0]
+            self._values[labels] = series
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(self.labelnames + ("le",), labels + (le,)),
+                    cumulative,
+                )
+            yield f"{self.name}_count", _format_labels(self.labelnames, labels), cumulative
+            yield f"{self.name}_sum", _format_labels(self.labelnames, labels), series[-1]
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(*self.labels, value=time.perf_counter() - self.started)
+
+
+class Registry:
+    def __init__(self, prefix: str = "weather"):
+        self.prefix = prefix
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        return self._add(Counter(f"{self.prefix}_{name}", help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames=()) -> Gauge:
+        return self._add(Gauge(f"{self.prefix}_{name}", help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(f"{self.prefix}_{name}", help_text, labelnames, buckets))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, component: str, stats_fn, label: str = None):
+        """Expose the numeric fields of a component's stats() dict as gauges
+
+        With ``label``, stats_fn returns {label_value: {field: number}} and each
+        field becomes one gauge labelled by the outer key.
+        """
+        self._collectors.append((component, stats_fn, label))
+
+    def _collected(self):
+        for component, stats_fn, label in self._collectors:
+            stats = stats_fn()
+            rows = stats.items() if label else [(None, stats)]
+            gauges = {}
+            for label_value, fields in rows:
+                for field, value in fields.items():
+                    if isinstance(value, bool) or not isinstance(value, (int, float)):
+                        continue
+                    name = f"{self.prefix}_{component}_{field}"
+                    gauge = gauges.get(name)
+                    if gauge is None:
+                        gauge = gauges[name] = Gauge(name, f"{component} {field}", (label,) if label else ())
+                    gauge.set(*((label_value,) if label else ()), value=value)
+            yield from gauges.values()
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics) + list(self._collected()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status")
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("route", "method")
+)
+http_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests currently being served")
+upstream_requests = registry.counter(
+    "upstream_requests_total", "OpenWeather calls by endpoint and status", ("endpoint", "status")
+)
+upstream_duration = registry.histogram(
+    "upstream_request_duration_seconds", "OpenWeather call latency by endpoint", ("endpoint",)
+)
+mongo_duration = registry.histogram(
+    "mongo_operation_duration_seconds", "MongoDB operation latency", ("collection", "operation")
+)
+
+
+async def observe_mongo(collection: str, operation: str, awaitable):
+    """Await a Motor operation within the request's deadline and record how long it took"""
+    with mongo_duration.time(collection, operation), span(f"mongo {collection}.{operation}", IO):
+        return await within_deadline(awaitable)
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording per-route latency, status and in-flight requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            # The route template keeps label cardinality bounded (no raw paths)
+            route = scope.get("route")
+            template = getattr(route, "path", "unmatched")
+            http_requests.inc(template, scope["method"], str(status))
+            http_request_duration.observe(template, scope["method"], value=elapsed)
@@ -0,0 +1,57 @@
+"""Online data migrations run in the background after startup.
+
+Older documents in status_checks and search_history store ``timestamp`` as
+an ISO 8601 string. ``migrate_string_timestamps`` rewrites them as native
+datetimes in small batches while the app keeps serving; each update is
+conditional on the old value, so running it twice, or from two instances at
+once, is harmless. Readers handle both types until it has finished.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from settings import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+
+def parse_timestamp(value: str):
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
+
+
+async def migrate_string_timestamps(collection, field: str = "timestamp") -> int:
+    """Convert string timestamps to datetimes; returns the number of documents updated"""
+    batch_size = env_int("MIGRATION_BATCH_SIZE", 500)
+    # Pause between batches so the migration never crowds out request traffic
+    pause = env_float("MIGRATION_PAUSE", 0.05)
+    last_id = None
+    updated = 0
+    skipped = 0
+    while True:
+        query = {field: {"$type": "string"}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        docs = await collection.find(query, {field: 1}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        operations = []
+        for doc in docs:
+            parsed = parse_timestamp(doc[field])
+            if parsed is None:
+                skipped += 1
+                continue
+            operations.append(UpdateOne({"_id": doc["_id"], field: doc[field]}, {"$set": {field: parsed}}))
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+        await asyncio.sleep(pause)
+    if updated or skipped:
+        logger.info(f"Migrated {updated} {collection.name} timestamps to datetimes ({skipped} unparseable)")
+    return updated
@@ -0,0 +1,153 @@
+"""Refresh-ahead prefetching of popular locations.
+
+Locations are ranked by how often they appear in ``search_history``, with
+older searches decaying exponentially. Cached payloads for the top locations
+are refreshed shortly before they expire, within a calls-per-minute budget
+and with jittered spacing so refreshes do not arrive upstream in bursts.
+An entry whose refresh fails is skipped for an exponentially growing
+backoff (PREFETCH_RETRY_BASE up to PREFETCH_RETRY_MAX seconds), so one
+failing location cannot hold the most urgent slot and starve the rest.
+"""
+import math
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+
+from settings import env_bool, env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchScheduler:
+    def __init__(self, history, targets, cache, refresh):
+        # targets(lat, lon) -> [(endpoint, params)] to keep warm for a location
+        # refresh(endpoint, params) re-fetches one payload upstream
+        self.history = history
+        self.targets = targets
+        self.cache = cache
+        self.refresh = refresh
+        self.enabled = env_bool("PREFETCH_ENABLED", True)
+        self.top_n = env_int("PREFETCH_TOP_N", 50)
+        self.calls_per_minute = env_float("PREFETCH_CALLS_PER_MINUTE", 30)
+        self.jitter = env_float("PREFETCH_JITTER", 0.3)
+        self.horizon = env_float("PREFETCH_HORIZON", 300)
+        self.half_life = env_float("PREFETCH_HALF_LIFE_HOURS", 24) * 3600
+        self.window = env_float("PREFETCH_WINDOW_HOURS", 7 * 24) * 3600
+        self.scan_limit = env_int("PREFETCH_HISTORY_SCAN", 5000)
+        self.rank_interval = env_float("PREFETCH_RANK_INTERVAL", 300)
+        self.retry_base = env_float("PREFETCH_RETRY_BASE", 60)
+        self.retry_max = env_float("PREFETCH_RETRY_MAX", 1800)
+        # cache key -> (consecutive failures, loop time before which it is skipped)
+        self._backoff = {}
+        self.ranked = []
+        self._ranked_at = None
+        self._task = None
+        self.refreshes = 0
+        self.errors = 0
+        self.backed_off = 0
+
+    def start(self):
+        if self.enabled and self.calls_per_minute > 0 and self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def rank(self) -> list:
+        """Top locations by exponentially decayed search frequency"""
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(seconds=self.window)
+        # Rows not yet migrated from ISO strings only compare against a string
+        cursor = self.history.find(
+            {"$or": [{"timestamp": {"$gte": cutoff}}, {"timestamp": {"$gte": cutoff.isoformat()}}]},
+            {"_id": 0, "lat": 1, "lon": 1, "timestamp": 1}
+        ).sort("timestamp", -1).limit(self.scan_limit)
+        scores = {}
+        async for doc in cursor:
+            searched_at = doc["timestamp"]
+            if isinstance(searched_at, str):
+                searched_at = datetime.fromisoformat(searched_at)
+            elif searched_at.tzinfo is None:
+                searched_at = searched_at.replace(tzinfo=timezone.utc)
+            age = (now - searched_at).total_seconds()
+            normalized = self.cache.normalize({"lat": doc["lat"], "lon": doc["lon"]})
+            location = (normalized["lat"], normalized["lon"])
+            scores[location] = scores.get(location, 0.0) + math.pow(0.5, age / self.half_life)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.top_n]
+        self.ranked = ranked
+        # Forget failures of entries that dropped out of the ranking
+        keys = {
+            self.cache.make_key(endpoint, self.cache.normalize(params))
+            for lat, lon in ranked for endpoint, params in self.targets(lat, lon)
+        }
+        self._backoff = {key: backoff for key, backoff in self._backoff.items() if key in keys}
+        self._ranked_at = asyncio.get_running_loop().time()
+        return ranked
+
+    def due(self, now: float) -> list:
+        """(seconds_left, rank, key, endpoint, params) for entries about to expire, most urgent first
+
+        Entries still backing off after a failed refresh are left out.
+        """
+        due = []
+        for position, (lat, lon) in enumerate(self.ranked):
+            for endpoint, params in self.targets(lat, lon):
+                key = self.cache.make_key(endpoint, self.cache.normalize(params))
+                backoff = self._backoff.get(key)
+                if backoff is not None and now < backoff[1]:
+                    continue
+                left = self.cache.ttl_left(key)
+                if left is None or left <= self.horizon:
+                    due.append((left if left is not None else -1.0, position, key, endpoint, params))
+        due.sort(key=lambda item: (item[0], item[1]))
+        return due
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                if self._ranked_at is None or loop.time() - self._ranked_at >= self.rank_interval:
+                    await self.rank()
+                due = self.due(loop.time())
+                if due:
+                    _, _, key, endpoint, params = due[0]
+                    try:
+                        await self.refresh(endpoint, params)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        self.back_off(key, loop.time())
+                        raise
+                    self._backoff.pop(key, None)
+                    self.refreshes += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Prefetch refresh failed: {e!r}")
+            # One call per budget slot, jittered so workers do not line up
+            interval = 60.0 / self.calls_per_minute
+            await asyncio.sleep(interval * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def back_off(self, key: str, now: float):
+        """Skip key for a while after a failed refresh, doubling the wait each time"""
+        failures = self._backoff[key][0] + 1 if key in self._backoff else 1
+        delay = min(self.retry_max, self.retry_base * 2 ** (failures - 1))
+        self._backoff[key] = (failures, now + delay)
+        self.backed_off += 1
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "running": self._task is not None,
+            "calls_per_minute": self.calls_per_minute,
+            "ranked_locations": len(self.ranked),
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "backed_off": self.backed_off,
+            "failing_entries": len(self._backoff),
+        }
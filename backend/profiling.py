@@ -0,0 +1,270 @@
+"""Opt-in request profiling with I/O and CPU spans.
+
+A sampled fraction of requests (PROFILE_SAMPLE_RATE), or any request that
+carries the debug header from an allow-listed client, gets a Profile in a
+ContextVar. Code wraps awaited calls in ``span(name, IO)`` and synchronous
+work in ``span(name, CPU)`` (or the ``cpu_span`` decorator); outside a
+profiled request a span is a single ContextVar lookup.
+
+A synchronous span cannot yield to the event loop, so its wall time is the
+request's own CPU time. Time not covered by any span is reported as "other"
+(routing, validation, response serialization, waiting for the loop).
+Profiled requests slower than PROFILE_SLOW_MS are written as JSON, with their
+span timeline, to a fixed-size ring of files in PROFILE_DIR.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import tempfile
+import functools
+from pathlib import Path
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from settings import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+IO = "io"
+CPU = "cpu"
+
+_current = ContextVar("profile", default=None)
+
+
+class Span:
+    __slots__ = ("profile", "name", "kind", "start", "end")
+
+    def __init__(self, profile, name: str, kind: str):
+        self.profile = profile
+        self.name = name
+        self.kind = kind
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.end = time.perf_counter()
+        self.profile.spans.append(self)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str, kind: str = IO):
+    """Time a block as part of the current request's profile, if there is one"""
+    profile = _current.get()
+    if profile is None:
+        return _NO_SPAN
+    return Span(profile, name, kind)
+
+
+def cpu_span(fn):
+    """Decorator recording a synchronous function as a CPU span"""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with span(fn.__name__, CPU):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def _union_length(intervals) -> float:
+    # Concurrent I/O overlaps; count each instant of waiting once
+    total = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+class Profile:
+    __slots__ = ("method", "path", "query", "reason", "started", "started_at", "spans")
+
+    def __init__(self, method: str, path: str, query: str, reason: str):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.reason = reason
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self.spans = []
+
+    def summary(self, now: float) -> dict:
+        total = now - self.started
+        io = _union_length([(s.start, s.end) for s in self.spans if s.kind == IO])
+        cpu = sum(s.end - s.start for s in self.spans if s.kind == CPU)
+        return {
+            "total_ms": round(total * 1000, 2),
+            "io_ms": round(io * 1000, 2),
+            "cpu_ms": round(cpu * 1000, 2),
+            "other_ms": round(max(0.0, total - io - cpu) * 1000, 2),
+        }
+
+    def to_dict(self, status: int, now: float) -> dict:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "status": status,
+            "reason": self.reason,
+            "started_at": self.started_at.isoformat(),
+            **self.summary(now),
+            "spans": [
+                {
+                    "name": s.name,
+                    "kind": s.kind,
+                    "start_ms": round((s.start - self.started) * 1000, 2),
+                    "duration_ms": round((s.end - s.start) * 1000, 2),
+                }
+                for s in sorted(self.spans, key=lambda s: s.start)
+            ],
+        }
+
+
+class Profiler:
+    def __init__(self):
+        self.sample_rate = env_float("PROFILE_SAMPLE_RATE", 0.0)
+        self.debug_header = os.environ.get("PROFILE_DEBUG_HEADER", "x-debug-profile").lower().encode()
+        # Client addresses as seen by the server (a proxy's address when behind one)
+        allowed = os.environ.get("PROFILE_ALLOWED_CLIENTS", "127.0.0.1,::1")
+        self.allowed_clients = {client.strip() for client in allowed.split(",") if client.strip()}
+        self.slow_ms = env_float("PROFILE_SLOW_MS", 500)
+        self.ring_size = env_int("PROFILE_RING_SIZE", 100)
+        self.directory = Path(os.environ.get("PROFILE_DIR") or Path(tempfile.gettempdir()) / "weather-profiles")
+        self._slot = None
+        self._writes = set()
+        self.sampled = 0
+        self.debugged = 0
+        self.slow = 0
+        self.write_errors = 0
+
+    def reason_for(self, scope) -> str:
+        """Why this request should be profiled, or None to skip it"""
+        for name, value in scope.get("headers", ()):
+            if name == self.debug_header and value not in (b"", b"0", b"false"):
+                client = scope.get("client")
+                if client and client[0] in self.allowed_clients:
+                    return "debug"
+                break
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    def _next_path(self) -> Path:
+        if self._slot is None:
+            # Resume after the newest file so a restart does not overwrite it first
+            existing = sorted(self.directory.glob("profile-*.json"), key=lambda p: p.stat().st_mtime)
+            try:
+                self._slot = int(existing[-1].stem.split("-")[1]) + 1 if existing else 0
+            except ValueError:
+                self._slot = 0
+        slot = self._slot % self.ring_size
+        self._slot = slot + 1
+        return self.directory / f"profile-{slot:04d}.json"
+
+    def _write(self, path: Path, report: dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(report, indent=2))
+        tmp.replace(path)
+
+    def record(self, profile: Profile, status: int, now: float):
+        if (now - profile.started) * 1000 < self.slow_ms or self.ring_size <= 0:
+            return
+        self.slow += 1
+        report = profile.to_dict(status, now)
+        # Slots are handed out on the loop thread so concurrent writes never collide
+        path = self._next_path()
+
+        async def write():
+            try:
+                await asyncio.to_thread(self._write, path, report)
+            except OSError as e:
+                self.write_errors += 1
+                logger.warning(f"Could not write slow request profile: {e!r}")
+
+        task = asyncio.ensure_future(write())
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def drain(self):
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "sample_rate": self.sample_rate,
+            "sampled": self.sampled,
+            "debugged": self.debugged,
+            "slow_written": self.slow,
+            "write_errors": self.write_errors,
+            "slow_ms": self.slow_ms,
+            "directory": str(self.directory),
+        }
+
+
+profiler = Profiler()
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware profiling sampled or debug-header requests
+
+    Debug requests get a Server-Timing header with the io/cpu/other split.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        reason = profiler.reason_for(scope)
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+        if reason == "debug":
+            profiler.debugged += 1
+        else:
+            profiler.sampled += 1
+        profile = Profile(scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"), reason)
+        token = _current.set(profile)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if reason == "debug":
+                    summary = profile.summary(time.perf_counter())
+                    timing = ", ".join(
+                        f"{key[:-3]};dur={value}" for key, value in summary.items()
+                    )
+                    message = {**message, "headers": list(message.get("headers", [])) + [
+                        (b"server-timing", timing.encode())
+                    ]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            profiler.record(profile, status, time.perf_counter())
@@ -0,0 +1,171 @@
+"""Token-bucket admission for upstream calls, with priority classes.
+
+Every upstream request takes a token from a bucket refilled at the plan's
+calls-per-minute rate. When the bucket is empty, callers queue by priority:
+interactive requests (including the bundle) are served first, then batch
+work, then background work: prefetch, stale revalidation, live pollers and
+hedges. Background work is also kept out of a reserve of tokens and is
+dropped rather than queued when the budget is tight.
+
+The bucket lives in each worker process, so QUOTA_CALLS_PER_MINUTE (the
+plan's limit) is split evenly across QUOTA_WORKERS workers, which defaults
+to uvicorn's WEB_CONCURRENCY. Set it to the number of workers sharing one API
+key, or N workers would make N times the plan's calls between them.
+QUOTA_BURST and QUOTA_BACKGROUND_RESERVE are per worker.
+"""
+import time
+import asyncio
+from collections import deque
+
+from settings import env_float, env_int
+
+INTERACTIVE = 0
+BULK = 1
+BACKGROUND = 2
+PRIORITY_NAMES = ("interactive", "bulk", "background")
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, priority: int, retry_after: float):
+        super().__init__(f"Upstream quota exhausted for {PRIORITY_NAMES[priority]} work")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class PriorityStats:
+    __slots__ = ("admitted", "dropped", "waited", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.admitted = 0
+        self.dropped = 0
+        self.waited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class UpstreamQuota:
+    def __init__(self):
+        # OpenWeather's free plan allows 60 calls/minute; 0 disables the limit
+        self.plan_calls_per_minute = env_float("QUOTA_CALLS_PER_MINUTE", 60)
+        self.workers = max(1, env_int("QUOTA_WORKERS", env_int("WEB_CONCURRENCY", 1)))
+        # This worker's share of the plan
+        self.calls_per_minute = self.plan_calls_per_minute / self.workers
+        self.burst = env_float("QUOTA_BURST", max(1.0, self.calls_per_minute / 6))
+        # Tokens background work may not touch, kept for user-facing requests
+        self.background_reserve = env_float("QUOTA_BACKGROUND_RESERVE", self.burst / 2)
+        self.max_wait = (
+            env_float("QUOTA_MAX_WAIT_INTERACTIVE", 10),
+            env_float("QUOTA_MAX_WAIT_BULK", 20),
+            env_float("QUOTA_MAX_WAIT_BACKGROUND", 0),
+        )
+        self.max_queue = (
+            env_int("QUOTA_MAX_QUEUE_INTERACTIVE", 1000),
+            env_int("QUOTA_MAX_QUEUE_BULK", 1000),
+            env_int("QUOTA_MAX_QUEUE_BACKGROUND", 0),
+        )
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._queues = [deque() for _ in PRIORITY_NAMES]
+        self._dispatcher = None
+        self.stats_by_priority = [PriorityStats() for _ in PRIORITY_NAMES]
+
+    @property
+    def enabled(self) -> bool:
+        return self.calls_per_minute > 0
+
+    @property
+    def rate(self) -> float:
+        return self.calls_per_minute / 60.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _floor(self, priority: int) -> float:
+        return self.background_reserve if priority == BACKGROUND else 0.0
+
+    def _queued_ahead(self, priority: int) -> bool:
+        return any(self._queues[p] for p in range(priority + 1))
+
+    async def acquire(self, priority: int = INTERACTIVE):
+        if not self.enabled:
+            return
+        stats = self.stats_by_priority[priority]
+        self._refill()
+        if not self._queued_ahead(priority) and self.tokens >= 1 + self._floor(priority):
+            self.tokens -= 1
+            stats.admitted += 1
+            return
+
+        retry_after = max(1.0, (1 + self._floor(priority) - self.tokens) / self.rate)
+        if len(self._queues[priority]) >= self.max_queue[priority] or self.max_wait[priority] <= 0:
+            stats.dropped += 1
+            raise QuotaExceeded(priority, retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].append(waiter)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.max_wait[priority])
+        except asyncio.TimeoutError:
+            stats.dropped += 1
+            raise QuotaExceeded(priority, retry_after)
+        waited = time.monotonic() - started
+        stats.admitted += 1
+        stats.waited += 1
+        stats.wait_total += waited
+        stats.wait_max = max(stats.wait_max, waited)
+
+    async def _dispatch(self):
+        # Hand tokens to queued callers, highest priority first, as they refill
+        while any(self._queues):
+            self._refill()
+            needed = None
+            for priority, queue in enumerate(self._queues):
+                while queue and queue[0].done():
+                    queue.popleft()  # timed out or cancelled while waiting
+                if not queue:
+                    continue
+                # Only the highest waiting class is served, so lower ones cannot starve it
+                needed = 1 + self._floor(priority)
+                if self.tokens >= needed:
+                    self.tokens -= 1
+                    queue.popleft().set_result(None)
+                    needed = 0
+                break
+            if needed is None:
+                break
+            await asyncio.sleep(max(0.0, needed - self.tokens) / self.rate)
+
+    def penalize(self):
+        """Upstream said 429 - stop spending until the bucket refills"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+    def stats(self) -> dict:
+        self._refill()
+        classes = {}
+        for priority, name in enumerate(PRIORITY_NAMES):
+            stats = self.stats_by_priority[priority]
+            classes[name] = {
+                "queued": sum(1 for waiter in self._queues[priority] if not waiter.done()),
+                "admitted": stats.admitted,
+                "dropped": stats.dropped,
+                "wait_avg_ms": round(stats.wait_total / stats.waited * 1000, 1) if stats.waited else 0.0,
+                "wait_max_ms": round(stats.wait_max * 1000, 1),
+            }
+        return {
+            "enabled": self.enabled,
+            "plan_calls_per_minute": self.plan_calls_per_minute,
+            "workers": self.workers,
+            "calls_per_minute": self.calls_per_minute,
+            "burst": self.burst,
+            "tokens": round(self.tokens, 2),
+            "classes": classes,
+        }
+
+
+upstream_quota = UpstreamQuota()
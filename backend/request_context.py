@@ -0,0 +1,154 @@
+"""Per-request state shared between middleware and the code a request runs.
+
+The middleware puts a RequestContext in a ContextVar before calling the app,
+so helpers deep in the call stack (e.g. fetch_openweather) can annotate the
+response without every route threading it through. It also records which
+upstream cache entries (and versions) the response was built from, and is
+left in ``scope["request_context"]`` for outer middleware to read.
+
+Each request also gets a deadline: the client's DEADLINE_HEADER budget in
+milliseconds (capped at DEADLINE_MAX) or the default for the longest
+matching path prefix in REQUEST_DEADLINES (0 means none, as for streams).
+``within_deadline`` bounds an awaitable by the time left and raises
+DeadlineExceeded once it has run out; upstream and Mongo calls go through it.
+The budget counts from ``scope["received_at"]`` when an outer middleware
+set it (admission does, before any queue wait), else from when the request
+reaches this middleware.
+"""
+import os
+import time
+import asyncio
+from contextvars import ContextVar
+
+from settings import env_float, env_float_map
+
+_current = ContextVar("request_context", default=None)
+
+# Seconds a request may take, by path prefix; streams have no deadline
+DEFAULT_DEADLINES = {
+    "/api/": 5.0,
+    "/api/weather/": 10.0,
+    "/api/weather/geocode": 3.0,
+    "/api/weather/reverse-geocode": 3.0,
+    "/api/weather/batch": 0.0,
+    "/api/weather/live": 0.0,
+}
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class RequestContext:
+    __slots__ = ("stale", "data_age", "dependencies", "cacheable", "deadline")
+
+    def __init__(self, deadline: float = None):
+        self.stale = False
+        self.data_age = 0.0
+        self.dependencies = []
+        self.cacheable = True
+        # time.monotonic() by which the response is due, or None
+        self.deadline = deadline
+
+    def time_left(self):
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def mark_stale(self, age: float):
+        self.stale = True
+        self.data_age = max(self.data_age, age)
+        self.cacheable = False
+
+    def depend(self, cache_key: str, version):
+        """The response was built from this upstream cache entry (None if it was not cached)"""
+        if version is None:
+            self.cacheable = False
+        else:
+            self.dependencies.append((cache_key, version))
+
+
+def current_context():
+    return _current.get()
+
+
+def time_left():
+    """Seconds left before the current request's deadline, or None if it has none"""
+    context = _current.get()
+    return context.time_left() if context is not None else None
+
+
+async def within_deadline(awaitable):
+    """Await with the current request's remaining time as the timeout"""
+    remaining = time_left()
+    if remaining is None:
+        return await awaitable
+    if remaining <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise DeadlineExceeded("Request deadline exceeded")
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError:
+        if time_left() > 0:
+            raise  # a timeout of the operation's own, not the deadline
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+def use_context(context: RequestContext):
+    """Make context current for the running task and any tasks it spawns"""
+    return _current.set(context)
+
+
+class RequestContextMiddleware:
+    """Pure ASGI middleware: installs a RequestContext and adds staleness headers"""
+
+    def __init__(self, app):
+        self.app = app
+        self.deadline_header = os.environ.get("DEADLINE_HEADER", "x-request-timeout-ms").lower().encode("latin-1")
+        self.max_deadline = env_float("DEADLINE_MAX", 30.0)
+        # Longest prefix first, so the most specific default wins
+        self.defaults = sorted(
+            env_float_map("REQUEST_DEADLINES", DEFAULT_DEADLINES).items(), key=lambda item: -len(item[0])
+        )
+
+    def budget_for(self, scope):
+        """Seconds the request may take, or None"""
+        for name, value in scope.get("headers", ()):
+            if name == self.deadline_header:
+                try:
+                    requested = float(value) / 1000
+                except ValueError:
+                    break
+                if requested > 0:
+                    return min(requested, self.max_deadline)
+                break
+        path = scope["path"]
+        for prefix, seconds in self.defaults:
+            if path.startswith(prefix):
+                return seconds if seconds > 0 else None
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        budget = self.budget_for(scope)
+        received_at = scope.get("received_at") or time.monotonic()
+        context = RequestContext(received_at + budget if budget is not None else None)
+        scope["request_context"] = context
+        token = use_context(context)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and context.stale:
+                headers = list(message.get("headers", []))
+                headers.append((b"warning", b'110 - "Response is Stale"'))
+                headers.append((b"x-data-stale", b"true"))
+                headers.append((b"x-data-age", str(int(context.data_age)).encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _current.reset(token)
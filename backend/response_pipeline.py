@@ -0,0 +1,301 @@
+"""Fast JSON encoding, compression and an encoded-response cache.
+
+``dumps`` uses orjson, and FastJSONResponse renders with it.
+ResponsePipelineMiddleware compresses complete (non-streamed) responses
+above RESPONSE_COMPRESS_MIN_BYTES with brotli or gzip, whichever the client
+prefers. orjson and brotli are pinned in requirements.txt; without them the
+stdlib json encoder and gzip alone are used (``stats()`` reports which).
+
+Successful GET /api/weather/* responses are also kept as encoded bytes,
+together with the versions of the upstream cache entries they were built
+from (recorded in the RequestContext by fetch_openweather). While every one
+of those entries is still fresh and unchanged, a repeat request is answered
+from the stored bytes, compressed once per encoding, without running the
+route or re-encoding anything. Entries are also capped at
+RESPONSE_CACHE_MAX_AGE seconds because some sections depend on the time of
+day as well as on the upstream payload.
+"""
+import gzip
+import json
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode
+
+from starlette.responses import JSONResponse
+
+from settings import env_float, env_int
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = (b"application/json", b"application/x-ndjson", b"text/")
+# Headers recomputed for every response sent from the cache
+_VOLATILE_HEADERS = {b"content-length", b"content-encoding", b"vary", b"server-timing"}
+
+
+def _default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    if hasattr(value, "tolist"):
+        return value.tolist()  # NumPy scalars and arrays
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=_default).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def negotiate(accept_encoding: str, available) -> str:
+    """Best content coding the client accepts among available, or None"""
+    best = None
+    best_q = 0.0
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        # Ties go to the earlier (better compressing) entry in available
+        if coding in available and q > 0 and (
+            best is None or q > best_q or (q == best_q and available.index(coding) < available.index(best))
+        ):
+            best = coding
+            best_q = q
+    return best
+
+
+class EncodedResponse:
+    __slots__ = ("status", "headers", "bodies", "dependencies", "expires_at", "size", "route")
+
+    def __init__(self, status: int, headers: list, body: bytes, dependencies: list, expires_at: float, route=None):
+        self.status = status
+        self.headers = headers
+        self.bodies = {None: body}
+        self.dependencies = dependencies
+        self.expires_at = expires_at
+        self.size = len(body)
+        # The router's route, so hits are labelled like the request that stored them
+        self.route = route
+
+
+class ResponsePipeline:
+    def __init__(self, cache):
+        # cache is the upstream ResponseCache whose entry versions responses depend on
+        self.cache = cache
+        self.min_bytes = env_int("RESPONSE_COMPRESS_MIN_BYTES", 1024)
+        self.gzip_level = env_int("RESPONSE_GZIP_LEVEL", 5)
+        self.brotli_quality = env_int("RESPONSE_BROTLI_QUALITY", 5)
+        self.max_bytes = env_int("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+        self.max_age = env_float("RESPONSE_CACHE_MAX_AGE", 60)
+        self.prefix = "/api/weather/"
+        self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def key_for(self, scope):
+        if scope["method"] != "GET" or not scope["path"].startswith(self.prefix):
+            return None
+        query = scope.get("query_string", b"").decode("latin-1")
+        return scope["path"] + "?" + urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+
+    def lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires_at <= time.monotonic() or any(
+            self.cache.version(dep_key) != version for dep_key, version in entry.dependencies
+        ):
+            self._remove(key)
+            self.invalidations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def store(self, key: str, status: int, headers: list, body: bytes, dependencies: list, route=None):
+        ttl = self.max_age
+        for dep_key, _ in dependencies:
+            left = self.cache.ttl_left(dep_key)
+            ttl = min(ttl, left if left is not None else 0.0)
+        if ttl <= 0 or len(body) > self.max_bytes:
+            return None
+        if key in self._entries:
+            self._remove(key)
+        headers = [(name, value) for name, value in headers if name.lower() not in _VOLATILE_HEADERS]
+        entry = EncodedResponse(status, headers, body, list(dependencies), time.monotonic() + ttl, route)
+        self._entries[key] = entry
+        self.bytes += entry.size
+        self.stores += 1
+        self._evict()
+        return entry
+
+    def body_for(self, entry: EncodedResponse, encoding):
+        body = entry.bodies.get(encoding)
+        if body is None:
+            body = self.compress(entry.bodies[None], encoding)
+            entry.bodies[encoding] = body
+            entry.size += len(body)
+            self.bytes += len(body)
+            self._evict()
+        return body
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        self.compressed += 1
+        self.bytes_in += len(body)
+        if encoding == "br":
+            result = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            result = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        self.bytes_out += len(result)
+        return result
+
+    def compressible(self, headers: list, body: bytes) -> bool:
+        if len(body) < self.min_bytes:
+            return False
+        content_type = b""
+        for name, value in headers:
+            name = name.lower()
+            if name == b"content-encoding":
+                return False
+            if name == b"content-type":
+                content_type = value.lower()
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    def _evict(self):
+        while self.bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "invalidations": self.invalidations,
+            "json_encoder": "orjson" if orjson is not None else "json",
+            "encodings": ",".join(self.encodings),
+            "compressed": self.compressed,
+            "compression_ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else 0.0,
+        }
+
+
+def _with_length(headers: list, body: bytes, encoding) -> list:
+    headers = [(name, value) for name, value in headers if name.lower() not in _VOLATILE_HEADERS]
+    headers.append((b"content-length", str(len(body)).encode()))
+    headers.append((b"vary", b"Accept-Encoding"))
+    if encoding is not None:
+        headers.append((b"content-encoding", encoding.encode()))
+    return headers
+
+
+class ResponsePipelineMiddleware:
+    """Pure ASGI middleware serving cached encoded responses and compressing the rest
+
+    It must sit inside CORSMiddleware, so cached responses still get CORS
+    headers, and outside RequestContextMiddleware, whose context it reads.
+    """
+
+    def __init__(self, app, pipeline: ResponsePipeline):
+        self.app = app
+        self.pipeline = pipeline
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        pipeline = self.pipeline
+        accept = ""
+        for name, value in scope.get("headers", ()):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = negotiate(accept, pipeline.encodings) if accept else None
+
+        key = pipeline.key_for(scope)
+        if key is not None:
+            entry = pipeline.lookup(key)
+            if entry is not None:
+                # The router never runs, so set the route it would have for outer middleware
+                if entry.route is not None:
+                    scope["route"] = entry.route
+                if len(entry.bodies[None]) < pipeline.min_bytes:
+                    encoding = None
+                body = pipeline.body_for(entry, encoding)
+                await send({
+                    "type": "http.response.start",
+                    "status": entry.status,
+                    "headers": _with_length(entry.headers, body, encoding),
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+
+        start = None
+
+        async def send_encoded(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # held back until we know whether the body is complete
+                return
+            if start is not None and message["type"] == "http.response.body":
+                pending, start = start, None
+                headers = list(pending.get("headers", []))
+                if message.get("more_body", False):
+                    # Streamed (NDJSON, SSE, listings): pass through untouched
+                    await send(pending)
+                    await send(message)
+                    return
+                body = message.get("body", b"")
+                context = scope.get("request_context")
+                entry = None
+                if (
+                    key is not None and pending["status"] == 200 and context is not None
+                    and context.cacheable and context.dependencies
+                ):
+                    entry = pipeline.store(
+                        key, pending["status"], headers, body, context.dependencies, scope.get("route")
+                    )
+                if pipeline.compressible(headers, body):
+                    if encoding is not None:
+                        body = pipeline.body_for(entry, encoding) if entry else pipeline.compress(body, encoding)
+                    headers = _with_length(headers, body, encoding)
+                await send({**pending, "headers": headers})
+                await send({**message, "body": body})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_encoded)
@@ -1,5 +1,6 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Query
 from dotenv import load_dotenv
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
@@ -8,24 +9,72 @@ from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
 import uuid
+import time
+import asyncio
 from datetime import datetime, timezone
 import httpx
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+from upstream import endpoint_name, upstream
+from cache import MongoResponseCache, response_cache, snap
+from singleflight import upstream_flights
+from gazetteer import Place, gazetteer
+from forecast_agg import aggregate_daily
+from compact import CompactForecast, as_compact, compact_payload
+from live import LiveHub
+from prefetch import PrefetchScheduler
+from quota import BACKGROUND, BULK, INTERACTIVE, QuotaExceeded, upstream_quota
+from breaker import upstream_breakers
+from request_context import (
+    DeadlineExceeded, RequestContext, RequestContextMiddleware, current_context, time_left, use_context,
+    within_deadline,
+)
+from metrics import MetricsMiddleware, observe_mongo, registry, upstream_duration, upstream_requests
+from profiling import CPU, IO, ProfilingMiddleware, cpu_span, profiler, span
+from write_behind import BufferFull, WriteBehindBuffer
+from keyset import NEXT_CURSOR_HEADER, InvalidCursor, Page, bson_datetime
+from migrations import migrate_string_timestamps
+from response_pipeline import FastJSONResponse, ResponsePipeline, ResponsePipelineMiddleware, dumps
+from units import CANONICAL, UNIT_SYSTEMS, convert_section, is_supported
+from alerts import alert_engine
+from solar import stats as solar_stats, uv_series
+from admission import AdmissionController, AdmissionMiddleware
+from hedging import upstream_hedger
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
+shared_cache = MongoResponseCache(db[os.environ.get('CACHE_L2_COLLECTION', 'upstream_cache')])
+
+# Append-only writes are buffered and flushed in batches off the request path
+status_writes = WriteBehindBuffer(db.status_checks, "status_checks")
+history_writes = WriteBehindBuffer(
+    db.search_history,
+    "search_history",
+    dedupe_key=lambda doc: (doc["city"].casefold(), doc["country"], round(doc["lat"], 2), round(doc["lon"], 2)),
+    dedupe_window=float(os.environ.get('HISTORY_DEDUPE_SECONDS', '60')),
+)
 
 # OpenWeather API
 OPENWEATHER_API_KEY = os.environ.get('OPENWEATHER_API_KEY')
-OPENWEATHER_BASE_URL = "https://api.openweathermap.org/data/2.5"
-OPENWEATHER_GEO_URL = "https://api.openweathermap.org/geo/1.0"
+OPENWEATHER_BASE_URL = os.environ.get('OPENWEATHER_BASE_URL', "https://api.openweathermap.org/data/2.5")
+OPENWEATHER_GEO_URL = os.environ.get('OPENWEATHER_GEO_URL', "https://api.openweathermap.org/geo/1.0")
 
 # Create the main app
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
+
+# Encoded responses are cached against the upstream cache entries they were built from
+response_pipeline = ResponsePipeline(response_cache)
+
+# Per-client rate limits and a global concurrency limit for API routes
+admission = AdmissionController()
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request, exc: DeadlineExceeded):
+    return FastJSONResponse({"detail": str(exc)}, status_code=504)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -63,69 +112,314 @@ class SearchHistory(BaseModel):
     country: str
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class BatchLocation(BaseModel):
+    lat: float
+    lon: float
+    id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    locations: List[BatchLocation]
+    sections: List[str] = ["current", "forecast"]
+    units: str = "metric"
+    concurrency: Optional[int] = None
+
+def check_units(units: str):
+    if not is_supported(units):
+        raise HTTPException(status_code=400, detail=f"Unknown units: {units} (expected {', '.join(UNIT_SYSTEMS)})")
+
 # Helper function for API calls
-async def fetch_openweather(endpoint: str, params: dict):
-    params["appid"] = OPENWEATHER_API_KEY
-    async with httpx.AsyncClient() as http_client:
+async def fetch_openweather(endpoint: str, params: dict, refresh: bool = False, priority: int = INTERACTIVE):
+    params = response_cache.normalize(params)
+    cache_key = response_cache.make_key(endpoint, params)
+    if refresh:
+        # Refreshes run at background priority; keep user requests from joining them
+        data, _ = await upstream_flights.do(
+            f"{cache_key}#refresh", lambda: load_openweather(endpoint, params, cache_key, True, priority)
+        )
+        return data
+
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        track_dependency(cache_key)
+        return cached
+    stale = response_cache.get_stale(cache_key)
+    if stale is not None:
+        # Serve the last known good copy now and revalidate in the background
+        data, age = stale
+        mark_response_stale(age)
+        revalidate_openweather(endpoint, params, cache_key)
+        return data
+
+    # Concurrent misses for the same key share one L2 lookup / upstream request;
+    # the shared call has no deadline of its own, and every caller stops waiting at its own
+    try:
+        data, stale_age = await within_deadline(upstream_flights.do(
+            cache_key, lambda: load_shared(endpoint, params, cache_key, priority)
+        ))
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    if stale_age is not None:
+        mark_response_stale(stale_age)
+    else:
+        track_dependency(cache_key)
+    return data
+
+def mark_response_stale(age: float):
+    context = current_context()
+    if context is not None:
+        context.mark_stale(age)
+
+def track_dependency(cache_key: str):
+    context = current_context()
+    if context is not None:
+        context.depend(cache_key, response_cache.version(cache_key))
+
+revalidations = set()
+
+def revalidate_openweather(endpoint: str, params: dict, cache_key: str):
+    if upstream_flights.in_flight(f"{cache_key}#refresh"):
+        return
+
+    async def revalidate():
+        # The refresh outlives the request; it must not inherit its deadline
+        use_context(RequestContext())
         try:
-            response = await http_client.get(endpoint, params=params, timeout=15)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            logger.error(f"OpenWeather API error: {e}")
-            raise HTTPException(status_code=e.response.status_code, detail=f"Weather API error: {str(e)}")
-        except httpx.RequestError as e:
-            logger.error(f"Request error: {e}")
-            raise HTTPException(status_code=503, detail="Weather service unavailable")
+            await fetch_openweather(endpoint, params, refresh=True, priority=BACKGROUND)
+        except HTTPException as e:
+            logger.info(f"Revalidation of {cache_key} failed ({e.status_code}), still serving stale copy")
+
+    task = asyncio.ensure_future(revalidate())
+    revalidations.add(task)
+    task.add_done_callback(revalidations.discard)
+
+async def load_shared(endpoint: str, params: dict, cache_key: str, priority: int):
+    # The flight runs in its own task; one caller's short budget must not fail the others
+    use_context(RequestContext())
+    return await load_openweather(endpoint, params, cache_key, False, priority)
+
+async def load_openweather(endpoint: str, params: dict, cache_key: str, refresh: bool = False, priority: int = INTERACTIVE):
+    """Fetch through L2 and upstream; returns (data, stale_age or None)"""
+    fallback = None
+    # A refresh goes straight upstream: the shared copy expires with ours
+    shared = None
+    if not refresh:
+        with span("shared_cache get", IO):
+            shared = await shared_cache.get(cache_key)
+    if shared is not None:
+        data, fresh_left, age = shared
+        data = compact_payload(endpoint, data)
+        response_cache.set(cache_key, data, fresh_left, age)
+        if fresh_left > 0:
+            return data, None
+        fallback = (data, age)
+
+    try:
+        data = await fetch_openweather_upstream(endpoint, dict(params), priority)
+    except HTTPException as e:
+        # Upstream is down or out of budget - a stale copy beats an error
+        if fallback is not None and (e.status_code >= 500 or e.status_code == 429):
+            return fallback
+        raise
+    ttl = response_cache.ttl_for(endpoint)
+    # L2 keeps the raw payload; L1 and callers get the compact form
+    shared_cache.put(cache_key, endpoint, params, data, ttl, response_cache.max_stale)
+    data = compact_payload(endpoint, data)
+    response_cache.set(cache_key, data, ttl)
+    return data, None
+
+async def fetch_openweather_upstream(endpoint: str, params: dict, priority: int = INTERACTIVE):
+    breaker = upstream_breakers.get(endpoint)
+    if not breaker.allow():
+        raise HTTPException(
+            status_code=503,
+            detail="Weather service unavailable",
+            headers={"Retry-After": str(int(breaker.retry_after()))}
+        )
+    try:
+        with span("quota wait", IO):
+            await within_deadline(upstream_quota.acquire(priority))
+    except DeadlineExceeded as e:
+        breaker.abandon()
+        raise HTTPException(status_code=504, detail=str(e))
+    except QuotaExceeded as e:
+        breaker.abandon()
+        logger.warning(f"{e}, retry in {e.retry_after:.0f}s")
+        raise HTTPException(
+            status_code=429,
+            detail="Weather service is busy, please retry shortly",
+            headers={"Retry-After": str(int(e.retry_after))}
+        )
+
+    params["appid"] = OPENWEATHER_API_KEY
+    name = endpoint_name(endpoint)
+    started = time.monotonic()
+    try:
+        with span(f"upstream {name}", IO):
+            # Timeouts shrink to the request's remaining budget; slow calls may be hedged
+            response = await within_deadline(upstream_hedger.run(
+                name, lambda: upstream.get(endpoint, params, time_left()), pay_for_hedge, time_left(),
+                usable=upstream_usable,
+            ))
+        upstream_duration.observe(name, value=time.monotonic() - started)
+        upstream_requests.inc(name, str(response.status_code))
+        response.raise_for_status()
+        with span(f"decode {name}", CPU):
+            data = response.json()
+    except httpx.HTTPStatusError as e:
+        logger.error(f"OpenWeather API error: {e}")
+        # 4xx means upstream is up and answering; only 5xx counts against the breaker
+        breaker.record(e.response.status_code < 500, time.monotonic() - started)
+        if e.response.status_code == 429:
+            upstream_quota.penalize()
+        raise HTTPException(status_code=e.response.status_code, detail=f"Weather API error: {str(e)}")
+    except httpx.RequestError as e:
+        logger.error(f"Request error: {e}")
+        upstream_duration.observe(name, value=time.monotonic() - started)
+        upstream_requests.inc(name, "error")
+        breaker.record(False, time.monotonic() - started)
+        raise HTTPException(status_code=503, detail="Weather service unavailable")
+    except DeadlineExceeded as e:
+        # Running out of our own time says nothing about upstream's health
+        upstream_requests.inc(name, "deadline")
+        breaker.abandon()
+        raise HTTPException(status_code=504, detail=str(e))
+    except asyncio.CancelledError:
+        breaker.abandon()
+        raise
+    except ValueError as e:
+        # A 200 that is not JSON (e.g. a maintenance page) is a failed call
+        logger.error(f"Invalid response from OpenWeather: {e}")
+        breaker.record(False, time.monotonic() - started)
+        raise HTTPException(status_code=502, detail="Invalid response from weather service")
+    except Exception:
+        # Anything else must still settle the breaker, or a half-open probe never finishes
+        breaker.record(False, time.monotonic() - started)
+        raise
+    breaker.record(True, time.monotonic() - started)
+    return data
+
+def upstream_usable(response: httpx.Response) -> bool:
+    # A fast 5xx or 429 from one request must not beat a good answer from the other
+    return response.status_code < 500 and response.status_code != 429
+
+async def pay_for_hedge() -> bool:
+    # Hedges take quota at background priority: skipped, never queued, when it is tight
+    try:
+        await upstream_quota.acquire(BACKGROUND)
+    except QuotaExceeded:
+        return False
+    return True
 
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "Weather API is running"}
 
+@api_router.get("/upstream/stats")
+async def get_upstream_stats():
+    """Connection pool and cache statistics for upstream weather calls"""
+    return {
+        "pool": upstream.stats(),
+        "cache": response_cache.stats(),
+        "shared_cache": shared_cache.stats(),
+        "coalescing": upstream_flights.stats(),
+        "gazetteer": gazetteer.stats(),
+        "alerts": alert_engine.stats(),
+        "solar": solar_stats(),
+        "live": live_hub.stats(),
+        "prefetch": prefetcher.stats(),
+        "quota": upstream_quota.stats(),
+        "breakers": upstream_breakers.stats(),
+        "profiling": profiler.stats(),
+        "responses": response_pipeline.stats(),
+        "admission": admission.stats(),
+        "hedging": upstream_hedger.stats(),
+        "write_behind": {
+            "status_checks": status_writes.stats(),
+            "search_history": history_writes.stats(),
+        },
+    }
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text exposition of request, upstream, Mongo and cache metrics"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.model_dump()
     status_obj = StatusCheck(**status_dict)
+    # Answer with the timestamp as it will read back from Mongo
+    status_obj.timestamp = bson_datetime(status_obj.timestamp)
     doc = status_obj.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
-    _ = await db.status_checks.insert_one(doc)
+    await buffered_write(status_writes, doc)
     return status_obj
 
-@api_router.get("/status", response_model=List[StatusCheck])
-async def get_status_checks():
-    status_checks = await db.status_checks.find({}, {"_id": 0}).to_list(1000)
-    for check in status_checks:
-        if isinstance(check['timestamp'], str):
-            check['timestamp'] = datetime.fromisoformat(check['timestamp'])
-    return status_checks
+async def buffered_write(buffer: WriteBehindBuffer, doc: dict) -> bool:
+    try:
+        return await within_deadline(buffer.add(doc))
+    except BufferFull as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=503, detail="Too many pending writes", headers={"Retry-After": "1"})
+
+@api_router.get("/status")
+async def get_status_checks(limit: int = Query(1000, ge=1, le=1000), cursor: Optional[str] = None):
+    """Status checks, newest first; pass X-Next-Cursor back as cursor for the next page"""
+    return await stream_listing(status_writes, StatusCheck, cursor, limit)
+
+async def stream_listing(buffer: WriteBehindBuffer, model, cursor: Optional[str], limit: int) -> StreamingResponse:
+    # Rows go through the route's model, as a response_model would: same fields
+    # and timestamp format as the POST response. Writes still in the buffer are
+    # merged in so they show up straight away
+    def serialize(doc: dict) -> bytes:
+        return dumps(model.model_validate(doc).model_dump(mode="json"))
+
+    try:
+        page = Page(buffer.collection, buffer.pending(), cursor, limit, serialize)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    await observe_mongo(buffer.name, "find_keys", page.prepare())
+    headers = {NEXT_CURSOR_HEADER: page.next_cursor} if page.next_cursor else None
+    return StreamingResponse(page.body(), media_type="application/json", headers=headers)
 
 # Geocoding - Search city by name
 @api_router.get("/weather/geocode")
 async def geocode_city(q: str = Query(..., min_length=2, description="City name")):
     """Search for city coordinates by name"""
+    # Autocomplete is served from the local gazetteer; upstream is the fallback
+    results = gazetteer.search(q, limit=5)
+    if len(results) >= gazetteer.min_local_results:
+        gazetteer.local_hits += 1
+        return results
+
+    gazetteer.fallbacks += 1
     data = await fetch_openweather(
         f"{OPENWEATHER_GEO_URL}/direct",
         {"q": q, "limit": 5}
     )
-    if not data:
+    if not data and not results:
         raise HTTPException(status_code=404, detail="City not found")
     
-    results = []
     for item in data:
-        results.append({
-            "name": item.get("name"),
-            "lat": item.get("lat"),
-            "lon": item.get("lon"),
-            "country": item.get("country"),
-            "state": item.get("state")
-        })
+        place = Place(
+            item.get("name"), item.get("country"), item.get("state"),
+            item.get("lat"), item.get("lon")
+        )
+        gazetteer.add(place)
+        if len(results) < 5 and place.to_dict() not in results:
+            results.append(place.to_dict())
     return results
 
 # Reverse geocoding - Get city name from coordinates
 @api_router.get("/weather/reverse-geocode")
 async def reverse_geocode(lat: float, lon: float):
     """Get city name from coordinates"""
+    place = gazetteer.nearest(lat, lon)
+    if place is not None:
+        gazetteer.reverse_local_hits += 1
+        return place.to_dict()
+
+    gazetteer.reverse_fallbacks += 1
     data = await fetch_openweather(
         f"{OPENWEATHER_GEO_URL}/reverse",
         {"lat": lat, "lon": lon, "limit": 1}
@@ -134,23 +428,27 @@ async def reverse_geocode(lat: float, lon: float):
         raise HTTPException(status_code=404, detail="Location not found")
     
     item = data[0]
-    return {
-        "name": item.get("name"),
-        "lat": item.get("lat"),
-        "lon": item.get("lon"),
-        "country": item.get("country"),
-        "state": item.get("state")
-    }
+    place = Place(
+        item.get("name"), item.get("country"), item.get("state"),
+        item.get("lat"), item.get("lon")
+    )
+    gazetteer.add(place)
+    return place.to_dict()
 
 # Current weather
 @api_router.get("/weather/current")
 async def get_current_weather(lat: float, lon: float, units: str = "metric"):
     """Get current weather for coordinates"""
+    check_units(units)
+    # Upstream is always asked for metric; the conversion happens locally
     data = await fetch_openweather(
         f"{OPENWEATHER_BASE_URL}/weather",
-        {"lat": lat, "lon": lon, "units": units}
+        {"lat": lat, "lon": lon, "units": CANONICAL}
     )
-    
+    return FastJSONResponse(convert_section("current", build_current_weather(data), units))
+
+@cpu_span
+def build_current_weather(data: dict) -> dict:
     return {
         "temp": data["main"]["temp"],
         "feels_like": data["main"]["feels_like"],
@@ -181,70 +479,21 @@ async def get_current_weather(lat: float, lon: float, units: str = "metric"):
 @api_router.get("/weather/forecast")
 async def get_forecast(lat: float, lon: float, units: str = "metric"):
     """Get 5-day weather forecast"""
+    check_units(units)
     data = await fetch_openweather(
         f"{OPENWEATHER_BASE_URL}/forecast",
-        {"lat": lat, "lon": lon, "units": units}
+        {"lat": lat, "lon": lon, "units": CANONICAL}
     )
-    
-    forecast_list = []
-    for item in data["list"]:
-        forecast_list.append({
-            "dt": item["dt"],
-            "temp": item["main"]["temp"],
-            "feels_like": item["main"]["feels_like"],
-            "temp_min": item["main"]["temp_min"],
-            "temp_max": item["main"]["temp_max"],
-            "humidity": item["main"]["humidity"],
-            "pressure": item["main"]["pressure"],
-            "wind_speed": item["wind"]["speed"],
-            "wind_deg": item["wind"].get("deg", 0),
-            "clouds": item["clouds"]["all"],
-            "pop": item.get("pop", 0),  # Probability of precipitation
-            "rain": item.get("rain", {}).get("3h", 0),
-            "snow": item.get("snow", {}).get("3h", 0),
-            "weather": {
-                "id": item["weather"][0]["id"],
-                "main": item["weather"][0]["main"],
-                "description": item["weather"][0]["description"],
-                "icon": item["weather"][0]["icon"]
-            }
-        })
-    
-    # Group by day for daily forecast
-    daily_forecast = {}
-    for item in forecast_list:
-        date = datetime.fromtimestamp(item["dt"]).strftime("%Y-%m-%d")
-        if date not in daily_forecast:
-            daily_forecast[date] = {
-                "date": date,
-                "temps": [],
-                "humidity": [],
-                "weather_ids": [],
-                "icons": [],
-                "pop": []
-            }
-        daily_forecast[date]["temps"].append(item["temp"])
-        daily_forecast[date]["humidity"].append(item["humidity"])
-        daily_forecast[date]["weather_ids"].append(item["weather"]["id"])
-        daily_forecast[date]["icons"].append(item["weather"]["icon"])
-        daily_forecast[date]["pop"].append(item["pop"])
-    
-    # Calculate daily summaries
-    daily_summary = []
-    for date, values in daily_forecast.items():
-        # Most common weather condition
-        most_common_icon = max(set(values["icons"]), key=values["icons"].count)
-        daily_summary.append({
-            "date": date,
-            "temp_min": min(values["temps"]),
-            "temp_max": max(values["temps"]),
-            "humidity_avg": sum(values["humidity"]) / len(values["humidity"]),
-            "pop_max": max(values["pop"]),
-            "icon": most_common_icon
-        })
+    return FastJSONResponse(convert_section("forecast", build_forecast(data), units))
+
+@cpu_span
+def build_forecast(forecast: CompactForecast) -> dict:
+    forecast = as_compact(forecast)
+    # Daily summaries, split on the location's local midnight
+    daily_summary = aggregate_daily(forecast.daily_columns(), forecast.timezone)
     
     return {
-        "hourly": forecast_list[:24],  # Next 24 hours (8 x 3-hour intervals)
+        "hourly": forecast.hourly(24),  # Next 24 hours (8 x 3-hour intervals)
         "daily": daily_summary[:5]  # 5 days
     }
 
@@ -256,7 +505,10 @@ async def get_air_quality(lat: float, lon: float):
         f"{OPENWEATHER_BASE_URL}/air_pollution",
         {"lat": lat, "lon": lon}
     )
-    
+    return FastJSONResponse(build_air_quality(data))
+
+@cpu_span
+def build_air_quality(data: dict) -> dict:
     if not data.get("list"):
         raise HTTPException(status_code=404, detail="Air quality data not available")
     
@@ -281,59 +533,44 @@ async def get_air_quality(lat: float, lon: float):
         "dt": aqi_data["dt"]
     }
 
-# UV Index (using One Call API 2.5 - we'll calculate from current data)
+# UV Index - estimated from solar elevation and the cached forecast's cloud cover
 @api_router.get("/weather/uv-index")
 async def get_uv_index(lat: float, lon: float):
-    """Get UV index - estimated based on weather conditions"""
-    # Get current weather to estimate UV
-    current = await fetch_openweather(
-        f"{OPENWEATHER_BASE_URL}/weather",
-        {"lat": lat, "lon": lon, "units": "metric"}
+    """Get the current UV index and an hourly estimate across the forecast horizon"""
+    # The forecast is almost always cached already for the same view
+    forecast_data = await fetch_openweather(
+        f"{OPENWEATHER_BASE_URL}/forecast",
+        {"lat": lat, "lon": lon, "units": CANONICAL}
     )
-    
-    # Calculate approximate UV based on time of day, clouds, and location
-    now = datetime.now(timezone.utc)
-    hour = now.hour
-    clouds = current["clouds"]["all"]
-    lat_factor = abs(lat) / 90  # Higher latitudes = lower UV
-    
-    # Base UV calculation (simplified)
-    if 6 <= hour <= 18:  # Daytime
-        base_uv = 8 * (1 - lat_factor * 0.5)  # Max UV around equator
-        # Adjust for time of day (peak at noon)
-        time_factor = 1 - abs(12 - hour) / 6
-        base_uv *= time_factor
-        # Reduce by cloud cover
-        cloud_factor = 1 - (clouds / 100) * 0.8
-        uv = base_uv * cloud_factor
-    else:
-        uv = 0
-    
-    uv = max(0, min(11, round(uv, 1)))  # Cap between 0-11
-    
-    # UV risk levels
+    return FastJSONResponse(build_uv_index(lat, lon, forecast_data))
+
+@cpu_span
+def build_uv_index(lat: float, lon: float, forecast: CompactForecast) -> dict:
+    forecast = as_compact(forecast)
+    if not len(forecast):
+        raise HTTPException(status_code=404, detail="Forecast data not available")
+    timestamps, uv = uv_series(lat, lon, forecast.dt, forecast.clouds, int(time.time()))
+    current = float(uv[0])
+    risk, color = get_uv_risk(current)
+    return {
+        "uv": current,
+        "risk": risk,
+        "color": color,
+        "recommendation": get_uv_recommendation(current),
+        "hourly": [{"dt": dt, "uv": value} for dt, value in zip(timestamps.tolist(), uv.tolist())],
+    }
+
+def get_uv_risk(uv: float):
     if uv <= 2:
-        risk = "Low"
-        color = "green"
+        return "Low", "green"
     elif uv <= 5:
-        risk = "Moderate"
-        color = "yellow"
+        return "Moderate", "yellow"
     elif uv <= 7:
-        risk = "High"
-        color = "orange"
+        return "High", "orange"
     elif uv <= 10:
-        risk = "Very High"
-        color = "red"
+        return "Very High", "red"
     else:
-        risk = "Extreme"
-        color = "purple"
-    
-    return {
-        "uv": uv,
-        "risk": risk,
-        "color": color,
-        "recommendation": get_uv_recommendation(uv)
-    }
+        return "Extreme", "purple"
 
 def get_uv_recommendation(uv: float) -> str:
     if uv <= 2:
@@ -351,112 +588,175 @@ def get_uv_recommendation(uv: float) -> str:
 @api_router.get("/weather/alerts")
 async def get_weather_alerts(lat: float, lon: float, units: str = "metric"):
     """Check for weather alerts based on conditions"""
-    current = await fetch_openweather(
-        f"{OPENWEATHER_BASE_URL}/weather",
-        {"lat": lat, "lon": lon, "units": units}
+    check_units(units)
+    # Independent upstream calls run side by side, within one deadline
+    current, forecast_data = await asyncio.gather(
+        fetch_openweather(f"{OPENWEATHER_BASE_URL}/weather", {"lat": lat, "lon": lon, "units": CANONICAL}),
+        fetch_openweather(f"{OPENWEATHER_BASE_URL}/forecast", {"lat": lat, "lon": lon, "units": CANONICAL}),
     )
-    
-    forecast_data = await fetch_openweather(
-        f"{OPENWEATHER_BASE_URL}/forecast",
-        {"lat": lat, "lon": lon, "units": units}
+    return FastJSONResponse(build_weather_alerts(current, forecast_data, units))
+
+@cpu_span
+def build_weather_alerts(current: dict, forecast_data: dict, units: str = CANONICAL) -> dict:
+    # Rules are evaluated on the metric payloads; only the alert text is converted
+    return alert_engine.evaluate(current, forecast_data, units)
+
+# Sections a location view is built from, and the upstream resources each needs
+WEATHER_SECTIONS = {
+    "current": ("weather",),
+    "forecast": ("forecast",),
+    "air_quality": ("air_pollution",),
+    "uv_index": ("forecast",),
+    "alerts": ("weather", "forecast"),
+}
+
+async def build_location_sections(lat: float, lon: float, units: str, sections, priority: int = BULK) -> dict:
+    """Fetch each upstream resource the sections need exactly once and build them"""
+    resources = sorted({name for section in sections for name in WEATHER_SECTIONS[section]})
+    resource_params = {
+        "weather": {"lat": lat, "lon": lon, "units": CANONICAL},
+        "forecast": {"lat": lat, "lon": lon, "units": CANONICAL},
+        "air_pollution": {"lat": lat, "lon": lon},
+    }
+    fetched = await asyncio.gather(
+        *[
+            fetch_openweather(f"{OPENWEATHER_BASE_URL}/{name}", resource_params[name], priority=priority)
+            for name in resources
+        ],
+        return_exceptions=True
     )
-    
-    alerts = []
-    
-    # Check current conditions for alerts
-    weather_id = current["weather"][0]["id"]
-    wind_speed = current["wind"]["speed"]
-    temp = current["main"]["temp"]
-    
-    # Thunderstorm alerts (200-299)
-    if 200 <= weather_id < 300:
-        alerts.append({
-            "type": "thunderstorm",
-            "severity": "warning",
-            "title": "Thunderstorm Warning",
-            "description": "Thunderstorm activity in your area. Stay indoors and away from windows.",
-            "icon": "cloud-lightning"
-        })
-    
-    # Heavy rain (502, 503, 504)
-    if weather_id in [502, 503, 504]:
-        alerts.append({
-            "type": "rain",
-            "severity": "warning",
-            "title": "Heavy Rain Alert",
-            "description": "Heavy rainfall expected. Be cautious of flooding.",
-            "icon": "cloud-rain"
-        })
-    
-    # Snow alerts (600-699)
-    if 600 <= weather_id < 700:
-        alerts.append({
-            "type": "snow",
-            "severity": "advisory",
-            "title": "Snow Advisory",
-            "description": "Snow expected. Drive carefully and prepare for winter conditions.",
-            "icon": "snowflake"
-        })
-    
-    # High wind alert
-    if wind_speed > 15:  # m/s
-        alerts.append({
-            "type": "wind",
-            "severity": "warning",
-            "title": "High Wind Warning",
-            "description": f"Strong winds of {wind_speed} m/s. Secure loose objects.",
-            "icon": "wind"
-        })
-    
-    # Extreme heat
-    if temp > 35:  # Celsius
-        alerts.append({
-            "type": "heat",
-            "severity": "warning",
-            "title": "Extreme Heat Warning",
-            "description": f"Temperature of {temp}°C. Stay hydrated and avoid outdoor activities.",
-            "icon": "thermometer"
-        })
-    
-    # Extreme cold
-    if temp < -10:
-        alerts.append({
-            "type": "cold",
-            "severity": "warning",
-            "title": "Extreme Cold Warning",
-            "description": f"Temperature of {temp}°C. Dress warmly and limit outdoor exposure.",
-            "icon": "thermometer-snowflake"
-        })
-    
-    # Fog alert (700-799)
-    if 700 <= weather_id < 800:
-        alerts.append({
-            "type": "fog",
-            "severity": "advisory",
-            "title": "Fog Advisory",
-            "description": "Reduced visibility due to fog. Drive with caution.",
-            "icon": "cloud-fog"
-        })
-    
-    # Check forecast for upcoming severe weather
-    for item in forecast_data["list"][:8]:  # Next 24 hours
-        forecast_id = item["weather"][0]["id"]
-        if 200 <= forecast_id < 300 and not any(a["type"] == "thunderstorm" for a in alerts):
-            dt = datetime.fromtimestamp(item["dt"])
-            alerts.append({
-                "type": "thunderstorm_forecast",
-                "severity": "watch",
-                "title": "Thunderstorm Watch",
-                "description": f"Thunderstorms possible around {dt.strftime('%I:%M %p')}.",
-                "icon": "cloud-lightning"
-            })
-            break
-    
-    return {
-        "alerts": alerts,
-        "count": len(alerts),
-        "has_warnings": any(a["severity"] == "warning" for a in alerts)
+    payloads = dict(zip(resources, fetched))
+
+    builders = {
+        "current": build_current_weather,
+        "forecast": build_forecast,
+        "air_quality": build_air_quality,
+        "uv_index": lambda forecast: build_uv_index(lat, lon, forecast),
+        "alerts": lambda current, forecast: build_weather_alerts(current, forecast, units),
     }
+    result = {}
+    errors = {}
+    for section in sections:
+        args = [payloads[name] for name in WEATHER_SECTIONS[section]]
+        failed = next((arg for arg in args if isinstance(arg, BaseException)), None)
+        try:
+            if failed is not None:
+                raise failed
+            result[section] = convert_section(section, builders[section](*args), units)
+        except HTTPException as e:
+            result[section] = None
+            errors[section] = {"status": e.status_code, "detail": e.detail}
+        except Exception as e:
+            logger.error(f"Section {section} failed for {lat},{lon}: {e}")
+            result[section] = None
+            errors[section] = {"status": 500, "detail": "Failed to build section"}
+    result["errors"] = errors
+    return result
+
+# Bundle - every section for one location view from a single fan-out
+@api_router.get("/weather/bundle")
+async def get_weather_bundle(lat: float, lon: float, units: str = "metric"):
+    """Get current, forecast, air quality, UV and alerts in one call"""
+    check_units(units)
+    # The bundle is the frontend's request for a location view
+    bundle = await build_location_sections(lat, lon, units, list(WEATHER_SECTIONS), priority=INTERACTIVE)
+    errors = bundle["errors"]
+    if len(errors) == len(WEATHER_SECTIONS):
+        first = next(iter(errors.values()))
+        raise HTTPException(status_code=first["status"], detail=first["detail"])
+    context = current_context()
+    if errors and context is not None:
+        # A partial bundle must not be replayed once the failed section recovers
+        context.cacheable = False
+    return FastJSONResponse(bundle)
+
+# Batch - many locations streamed back as NDJSON as each one completes
+BATCH_MAX_LOCATIONS = int(os.environ.get('BATCH_MAX_LOCATIONS', '1000'))
+BATCH_MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', '16'))
+
+@api_router.post("/weather/batch")
+async def get_weather_batch(request: BatchRequest):
+    """Get weather sections for many locations, streamed as NDJSON"""
+    unknown = [section for section in request.sections if section not in WEATHER_SECTIONS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown sections: {', '.join(unknown)}")
+    check_units(request.units)
+    if len(request.locations) > BATCH_MAX_LOCATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_LOCATIONS} locations per batch")
+    concurrency = min(request.concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    return StreamingResponse(
+        stream_batch(request.locations, request.sections, request.units, max(1, concurrency)),
+        media_type="application/x-ndjson"
+    )
+
+async def fetch_batch_location(index: int, location: BatchLocation, sections, units: str) -> dict:
+    # Each location runs in its own task, so it gets its own staleness marker
+    context = RequestContext()
+    use_context(context)
+    line = {"index": index, "id": location.id, "lat": location.lat, "lon": location.lon}
+    line.update(await build_location_sections(location.lat, location.lon, units, sections))
+    line["stale"] = context.stale
+    return line
+
+async def stream_batch(locations, sections, units: str, concurrency: int):
+    # At most `concurrency` locations are in flight and each result is written
+    # out as soon as it is ready, so memory does not grow with the batch size
+    queue = iter(enumerate(locations))
+    pending = set()
+    try:
+        while True:
+            while len(pending) < concurrency:
+                item = next(queue, None)
+                if item is None:
+                    break
+                pending.add(asyncio.ensure_future(fetch_batch_location(*item, sections, units)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield dumps(task.result()) + b"\n"
+    finally:
+        # Client went away - don't leave orphaned upstream calls behind
+        for task in pending:
+            task.cancel()
+
+# Live updates - Server-Sent Events fed by one shared poller per location
+async def fetch_live_snapshot(lat: float, lon: float, units: str) -> dict:
+    # Pollers outlive the request that started them, so they get their own context (no deadline)
+    use_context(RequestContext())
+    # Polls are background work: under quota pressure they give way to user views
+    snapshot = await build_location_sections(lat, lon, units, list(WEATHER_SECTIONS), priority=BACKGROUND)
+    if any(error["status"] == 429 for error in snapshot["errors"].values()):
+        return None  # skip this round rather than blank out sections subscribers already have
+    return snapshot
+
+live_hub = LiveHub(
+    fetch_live_snapshot,
+    lambda lat, lon: (snap(lat, response_cache.grid), snap(lon, response_cache.grid))
+)
+
+@api_router.get("/weather/live")
+async def stream_live_weather(lat: float, lon: float, units: str = "metric"):
+    """Subscribe to weather changes for a location (text/event-stream)"""
+    check_units(units)
+    return StreamingResponse(
+        stream_live_events(lat, lon, units),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def stream_live_events(lat: float, lon: float, units: str):
+    subscriber = live_hub.subscribe(lat, lon, units)
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), live_hub.heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"event: {message['type']}\ndata: ".encode() + dumps(message['data']) + b"\n\n"
+    finally:
+        live_hub.unsubscribe(subscriber)
 
 # Search history
 @api_router.post("/weather/history")
@@ -464,34 +764,149 @@ async def save_search_history(city: str, lat: float, lon: float, country: str):
     """Save search to history"""
     history = SearchHistory(city=city, lat=lat, lon=lon, country=country)
     doc = history.model_dump()
-    doc['timestamp'] = doc['timestamp'].isoformat()
-    await db.search_history.insert_one(doc)
+    doc['timestamp'] = bson_datetime(doc['timestamp'])
+    # A repeat of a search made moments ago is acknowledged but not stored again
+    await buffered_write(history_writes, doc)
     return {"message": "Saved to history"}
 
 @api_router.get("/weather/history")
-async def get_search_history(limit: int = 5):
-    """Get recent search history"""
-    history = await db.search_history.find(
-        {}, {"_id": 0}
-    ).sort("timestamp", -1).limit(limit).to_list(limit)
-    
-    for item in history:
-        if isinstance(item['timestamp'], str):
-            item['timestamp'] = datetime.fromisoformat(item['timestamp'])
-    
-    return history
+async def get_search_history(limit: int = Query(5, ge=1, le=1000), cursor: Optional[str] = None):
+    """Get recent search history; pass X-Next-Cursor back as cursor for older entries"""
+    return await stream_listing(history_writes, SearchHistory, cursor, limit)
+
+# Refresh-ahead for the most searched locations
+def prefetch_targets(lat: float, lon: float):
+    return [
+        (f"{OPENWEATHER_BASE_URL}/weather", {"lat": lat, "lon": lon, "units": CANONICAL}),
+        (f"{OPENWEATHER_BASE_URL}/forecast", {"lat": lat, "lon": lon, "units": CANONICAL}),
+        (f"{OPENWEATHER_BASE_URL}/air_pollution", {"lat": lat, "lon": lon}),
+    ]
+
+prefetcher = PrefetchScheduler(
+    db.search_history,
+    prefetch_targets,
+    response_cache,
+    lambda endpoint, params: fetch_openweather(endpoint, params, refresh=True, priority=BACKGROUND)
+)
+
+# Component statistics exported alongside the request metrics
+BREAKER_STATE_CODES = {"closed": 0, "half_open": 1, "open": 2}
+
+registry.register_stats("pool", upstream.stats)
+registry.register_stats("cache", response_cache.stats)
+registry.register_stats("shared_cache", shared_cache.stats)
+registry.register_stats("coalescing", upstream_flights.stats)
+registry.register_stats("gazetteer", gazetteer.stats)
+registry.register_stats("alerts", alert_engine.stats)
+registry.register_stats("solar", solar_stats)
+registry.register_stats("live", live_hub.stats)
+registry.register_stats("prefetch", prefetcher.stats)
+registry.register_stats("profiling", profiler.stats)
+registry.register_stats("responses", response_pipeline.stats)
+registry.register_stats("admission", admission.stats)
+registry.register_stats("hedging", upstream_hedger.stats)
+registry.register_stats(
+    "write_behind",
+    lambda: {"status_checks": status_writes.stats(), "search_history": history_writes.stats()},
+    label="collection",
+)
+registry.register_stats("quota", lambda: upstream_quota.stats()["classes"], label="priority")
+registry.register_stats(
+    "breaker",
+    lambda: {
+        name: dict(stats, state=BREAKER_STATE_CODES[stats["state"]])
+        for name, stats in upstream_breakers.stats().items()
+    },
+    label="endpoint",
+)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Deadlines count from when admission first saw the request, queue wait included
+app.add_middleware(RequestContextMiddleware)
+
+# Inside the response pipeline so cached responses skip admission entirely
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
+# Inside CORS so cached responses still get CORS headers
+app.add_middleware(ResponsePipelineMiddleware, pipeline=response_pipeline)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+app.add_middleware(ProfilingMiddleware)
+
+# Added last so it is outermost and times the whole middleware stack
+app.add_middleware(MetricsMiddleware)
+
+@app.on_event("startup")
+async def startup_upstream_client():
+    await upstream.start()
+
+@app.on_event("startup")
+async def startup_gazetteer():
+    await asyncio.to_thread(gazetteer.load)
+
+@app.on_event("startup")
+async def startup_shared_cache():
+    try:
+        await shared_cache.ensure_indexes()
+    except Exception as e:
+        logger.warning(f"Could not create upstream cache indexes: {e!r}")
+
+@app.on_event("startup")
+async def startup_prefetcher():
+    prefetcher.start()
+
+@app.on_event("startup")
+async def startup_write_behind():
+    status_writes.start()
+    history_writes.start()
+
+migrations = set()
+
+@app.on_event("startup")
+async def startup_timestamp_migration():
+    for collection in (db.status_checks, db.search_history):
+        try:
+            await collection.create_index([("timestamp", -1), ("id", -1)])
+        except Exception as e:
+            logger.warning(f"Could not create {collection.name} timestamp index: {e!r}")
+        # Legacy ISO string timestamps are converted in the background
+        task = asyncio.ensure_future(migrate_string_timestamps(collection))
+        migrations.add(task)
+        task.add_done_callback(migrations.discard)
+
+@app.on_event("shutdown")
+async def shutdown_timestamp_migration():
+    for task in list(migrations):
+        task.cancel()
+    await asyncio.gather(*migrations, return_exceptions=True)
+
+@app.on_event("shutdown")
+async def shutdown_prefetcher():
+    await prefetcher.stop()
+
+@app.on_event("shutdown")
+async def shutdown_live_pollers():
+    await live_hub.stop()
+
+@app.on_event("shutdown")
+async def shutdown_upstream_client():
+    await shared_cache.drain()
+    await profiler.drain()
+    await upstream.close()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Flush buffered writes before the connection goes away
+    await status_writes.stop()
+    await history_writes.stop()
     client.close()
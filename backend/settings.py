@@ -0,0 +1,30 @@
+"""Small helpers for reading tuning knobs from the environment."""
+import os
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_float_map(name: str, defaults: dict) -> dict:
+    """Read "key=value,key=value" overrides on top of a dict of floats"""
+    result = dict(defaults)
+    for part in os.environ.get(name, "").split(","):
+        if "=" not in part:
+            continue
+        key, value = part.split("=", 1)
+        result[key.strip()] = float(value)
+    return result
@@ -0,0 +1,47 @@
+"""Coalesce concurrent identical upstream calls into a single request.
+
+The first caller for a key starts the work as a task; callers arriving while
+it is in flight await the same task instead of issuing their own request.
+"""
+import asyncio
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self.started = 0
+        self.deduplicated = 0
+
+    async def do(self, key: str, fn):
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._flights[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.started += 1
+        else:
+            self.deduplicated += 1
+        # shield() keeps one cancelled caller (e.g. a client disconnect) from
+        # cancelling the shared call for everyone else still waiting on it.
+        # Errors raised by the call propagate to every waiter.
+        return await asyncio.shield(task)
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every waiter went away
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._flights),
+            "started": self.started,
+            "deduplicated": self.deduplicated,
+        }
+
+
+upstream_flights = SingleFlight()
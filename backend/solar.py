@@ -0,0 +1,98 @@
+"""Vectorized solar position and a clear-sky UV index model.
+
+Solar elevation uses the NOAA low-precision formulas: the declination and the
+equation of time depend only on the day of the year, and the latitude
+enters through sin(lat)·sin(decl) and cos(lat)·cos(decl). Those two terms are
+precomputed for every day of the year once per latitude bucket
+(SOLAR_LAT_BUCKET_DEG, memoized), so an hourly series for any number of
+timestamps at a location is just table lookups plus one cosine of the hour
+angle, which follows the location's own solar time rather than the server
+clock.
+
+The UV index is the clear-sky estimate 12.5·sin(elevation)^2.42, reduced by
+cloud cover.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from settings import env_float
+
+SECONDS_PER_DAY = 86400
+LAT_BUCKET_DEG = env_float("SOLAR_LAT_BUCKET_DEG", 0.25)
+# Fractional year at the start of each day, for a 366-day table
+_GAMMA = 2 * np.pi / 365 * np.arange(366)
+
+
+def _declination(gamma):
+    return (0.006918 - 0.399912 * np.cos(gamma) + 0.070257 * np.sin(gamma)
+            - 0.006758 * np.cos(2 * gamma) + 0.000907 * np.sin(2 * gamma)
+            - 0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma))
+
+
+def _equation_of_time(gamma):
+    """Minutes between apparent and mean solar time"""
+    return 229.18 * (0.000075 + 0.001868 * np.cos(gamma) - 0.032077 * np.sin(gamma)
+                     - 0.014615 * np.cos(2 * gamma) - 0.040849 * np.sin(2 * gamma))
+
+
+_DECLINATION = _declination(_GAMMA)
+_EQUATION_OF_TIME = _equation_of_time(_GAMMA)
+
+
+def lat_bucket(lat: float) -> float:
+    return round(round(lat / LAT_BUCKET_DEG) * LAT_BUCKET_DEG, 6)
+
+
+@lru_cache(maxsize=1024)
+def solar_table(bucket: float):
+    """Per-day-of-year (sin lat·sin decl, cos lat·cos decl) for one latitude bucket"""
+    phi = np.radians(bucket)
+    return np.sin(phi) * np.sin(_DECLINATION), np.cos(phi) * np.cos(_DECLINATION)
+
+
+def solar_elevation(lat: float, lon: float, timestamps) -> np.ndarray:
+    """Solar elevation in degrees at each UTC unix timestamp"""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    days = timestamps // SECONDS_PER_DAY
+    # Day of year (0-365) from the civil date, without building datetimes
+    day_of_year = (days.astype("datetime64[D]") - days.astype("datetime64[D]").astype("datetime64[Y]")).astype(np.int64)
+    minutes = (timestamps - days * SECONDS_PER_DAY) / 60
+    solar_minutes = minutes + _EQUATION_OF_TIME[day_of_year] + 4 * lon
+    hour_angle = np.radians(solar_minutes / 4 - 180)
+    sin_term, cos_term = solar_table(lat_bucket(lat))
+    sin_elevation = sin_term[day_of_year] + cos_term[day_of_year] * np.cos(hour_angle)
+    return np.degrees(np.arcsin(np.clip(sin_elevation, -1, 1)))
+
+
+def uv_index(elevation, clouds) -> np.ndarray:
+    """UV index from solar elevation (degrees) and cloud cover (percent)"""
+    mu = np.clip(np.sin(np.radians(elevation)), 0, None)
+    clear_sky = 12.5 * mu ** 2.42
+    cloud_factor = 1 - (np.asarray(clouds, dtype=np.float64) / 100) * 0.8
+    return np.clip(np.round(clear_sky * cloud_factor, 1), 0, 11)
+
+
+def uv_series(lat: float, lon: float, forecast_times, forecast_clouds, start: int, hours: int = None):
+    """Hourly (timestamps, uv) from ``start`` to the end of the forecast
+
+    Cloud cover is interpolated between the 3-hourly forecast items.
+    """
+    forecast_times = np.asarray(forecast_times, dtype=np.int64)
+    start = start - start % 3600
+    end = max(int(forecast_times[-1]), start) if len(forecast_times) else start
+    if hours is not None:
+        end = min(end, start + (hours - 1) * 3600)
+    timestamps = np.arange(start, end + 1, 3600, dtype=np.int64)
+    clouds = np.interp(timestamps, forecast_times, forecast_clouds) if len(forecast_times) else np.zeros(len(timestamps))
+    return timestamps, uv_index(solar_elevation(lat, lon, timestamps), clouds)
+
+
+def stats() -> dict:
+    info = solar_table.cache_info()
+    return {
+        "lat_bucket_deg": LAT_BUCKET_DEG,
+        "tables": info.currsize,
+        "table_hits": info.hits,
+        "table_misses": info.misses,
+    }
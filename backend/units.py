@@ -0,0 +1,113 @@
+"""Local unit conversion for weather payloads.
+
+Everything is fetched from OpenWeather in one canonical system (metric), so
+metric, imperial and standard users of a location share one upstream call
+and one cache entry. Sections are built from the metric payload and only
+their output is converted here: temperatures, wind speeds and visibility.
+Forecast sections are converted in bulk by pulling every temperature and
+speed into one NumPy array per quantity.
+
+Thresholds (alerts, for example) must be evaluated before conversion, on
+the canonical values.
+"""
+import numpy as np
+
+CANONICAL = "metric"
+UNIT_SYSTEMS = ("metric", "imperial", "standard")
+
+TEMPERATURE_SYMBOLS = {"metric": "°C", "imperial": "°F", "standard": "K"}
+SPEED_SYMBOLS = {"metric": "m/s", "imperial": "mph", "standard": "m/s"}
+
+MPS_TO_MPH = 3600 / 1609.344
+KM_PER_MILE = 1.609344
+
+_TEMPERATURE_FIELDS = ("temp", "feels_like", "temp_min", "temp_max")
+_DAILY_TEMPERATURE_FIELDS = ("temp_min", "temp_max", "temp_avg")
+
+
+def is_supported(units: str) -> bool:
+    return units in UNIT_SYSTEMS
+
+
+def convert_temperature(celsius, units: str):
+    """Celsius to the temperature unit of ``units``; scalars or arrays"""
+    if units == "imperial":
+        return celsius * 9 / 5 + 32
+    if units == "standard":
+        return celsius + 273.15
+    return celsius
+
+
+def convert_speed(mps, units: str):
+    """Metres per second to the speed unit of ``units``; scalars or arrays"""
+    if units == "imperial":
+        return mps * MPS_TO_MPH
+    return mps
+
+
+def convert_visibility(km, units: str):
+    """Kilometres to miles for imperial, unchanged otherwise"""
+    if units == "imperial":
+        return km / KM_PER_MILE
+    return km
+
+
+def format_temperature(celsius: float, units: str) -> str:
+    return f"{round(float(convert_temperature(celsius, units)), 1)}{TEMPERATURE_SYMBOLS.get(units, '°C')}"
+
+
+def format_speed(mps: float, units: str) -> str:
+    return f"{round(float(convert_speed(mps, units)), 1)} {SPEED_SYMBOLS.get(units, 'm/s')}"
+
+
+def _scalar(value, convert, units: str, digits: int = 2):
+    if value is None:
+        return None
+    return round(float(convert(value, units)), digits)
+
+
+def _convert_rows(rows: list, fields, convert, units: str):
+    """Convert ``fields`` of every row with one array operation"""
+    if not rows:
+        return
+    values = convert(np.array([[row[field] for field in fields] for row in rows], dtype=np.float64), units)
+    values = np.round(values, 2).tolist()
+    for row, converted in zip(rows, values):
+        row.update(zip(fields, converted))
+
+
+def convert_current(current: dict, units: str) -> dict:
+    if units == CANONICAL:
+        return current
+    converted = dict(current)
+    for field in _TEMPERATURE_FIELDS:
+        converted[field] = _scalar(current[field], convert_temperature, units)
+    converted["wind_speed"] = _scalar(current["wind_speed"], convert_speed, units)
+    converted["wind_gust"] = _scalar(current.get("wind_gust"), convert_speed, units)
+    converted["visibility"] = _scalar(current["visibility"], convert_visibility, units)
+    return converted
+
+
+def convert_forecast(forecast: dict, units: str) -> dict:
+    if units == CANONICAL:
+        return forecast
+    hourly = [dict(item) for item in forecast["hourly"]]
+    daily = [dict(day) for day in forecast["daily"]]
+    _convert_rows(hourly, _TEMPERATURE_FIELDS, convert_temperature, units)
+    _convert_rows(hourly, ("wind_speed",), convert_speed, units)
+    _convert_rows(daily, _DAILY_TEMPERATURE_FIELDS, convert_temperature, units)
+    return {**forecast, "hourly": hourly, "daily": daily}
+
+
+# Section name -> converter; sections not listed are unit-free
+SECTION_CONVERTERS = {
+    "current": convert_current,
+    "forecast": convert_forecast,
+}
+
+
+def convert_section(section: str, payload, units: str):
+    converter = SECTION_CONVERTERS.get(section)
+    if converter is None or payload is None:
+        return payload
+    return converter(payload, units)
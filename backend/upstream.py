@@ -0,0 +1,133 @@
+"""Shared HTTP client for upstream (OpenWeather) calls.
+
+One pooled ``httpx.AsyncClient`` lives for the lifetime of the app so that
+requests reuse warm TCP/TLS connections instead of handshaking every time.
+"""
+import logging
+from urllib.parse import urlsplit
+
+import httpx
+
+from settings import env_bool, env_float, env_float_map, env_int
+
+logger = logging.getLogger(__name__)
+
+
+def endpoint_name(endpoint: str) -> str:
+    """Short name of an upstream endpoint, e.g. 'weather' or 'direct'"""
+    return urlsplit(endpoint).path.rstrip("/").rsplit("/", 1)[-1]
+
+
+# Read timeouts per upstream endpoint (seconds). Geocoding is quick, the
+# forecast payload is the largest. Override with e.g.
+# UPSTREAM_TIMEOUTS="weather=4,forecast=10".
+DEFAULT_ENDPOINT_TIMEOUTS = {
+    "weather": 8.0,
+    "forecast": 10.0,
+    "air_pollution": 8.0,
+    "direct": 5.0,
+    "reverse": 5.0,
+}
+
+
+class UpstreamClient:
+    def __init__(self):
+        self.max_connections = env_int("UPSTREAM_MAX_CONNECTIONS", 100)
+        self.max_keepalive = env_int("UPSTREAM_MAX_KEEPALIVE", 20)
+        self.keepalive_expiry = env_float("UPSTREAM_KEEPALIVE_EXPIRY", 30.0)
+        self.connect_timeout = env_float("UPSTREAM_CONNECT_TIMEOUT", 3.0)
+        self.pool_timeout = env_float("UPSTREAM_POOL_TIMEOUT", 5.0)
+        self.default_timeout = env_float("UPSTREAM_TIMEOUT", 15.0)
+        self.endpoint_timeouts = env_float_map("UPSTREAM_TIMEOUTS", DEFAULT_ENDPOINT_TIMEOUTS)
+        self.http2 = env_bool("UPSTREAM_HTTP2")
+        self._client = None
+        self._transport = None
+        self.requests = 0
+        self.connections_opened = 0
+        self.errors = 0
+
+    async def start(self):
+        if self._client is not None:
+            return
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("UPSTREAM_HTTP2 is set but the 'h2' package is not installed, using HTTP/1.1")
+                http2 = False
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        self._transport = httpx.AsyncHTTPTransport(limits=limits, http2=http2)
+        self._client = httpx.AsyncClient(
+            transport=self._transport,
+            timeout=httpx.Timeout(self.default_timeout, connect=self.connect_timeout, pool=self.pool_timeout),
+        )
+        logger.info(
+            f"Upstream client started (max_connections={self.max_connections}, "
+            f"max_keepalive={self.max_keepalive}, http2={http2})"
+        )
+
+    async def close(self):
+        if self._client is None:
+            return
+        await self._client.aclose()
+        self._client = None
+        self._transport = None
+
+    def timeout_for(self, endpoint: str, budget: float = None) -> httpx.Timeout:
+        """Per-endpoint timeouts, none longer than the caller's remaining budget"""
+        read = self.endpoint_timeouts.get(endpoint_name(endpoint), self.default_timeout)
+        connect = self.connect_timeout
+        pool = self.pool_timeout
+        if budget is not None:
+            budget = max(0.001, budget)
+            read, connect, pool = min(read, budget), min(connect, budget), min(pool, budget)
+        return httpx.Timeout(read, connect=connect, pool=pool)
+
+    async def _trace(self, event: str, info: dict):
+        if event == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    async def get(self, endpoint: str, params: dict, budget: float = None) -> httpx.Response:
+        if self._client is None:
+            # Used outside the app lifespan (scripts, tests) - open lazily
+            await self.start()
+        self.requests += 1
+        try:
+            return await self._client.get(
+                endpoint,
+                params=params,
+                timeout=self.timeout_for(endpoint, budget),
+                extensions={"trace": self._trace},
+            )
+        except httpx.RequestError:
+            self.errors += 1
+            raise
+
+    def stats(self) -> dict:
+        connections = []
+        pool = getattr(self._transport, "_pool", None)
+        if pool is not None:
+            connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        reused = max(0, self.requests - self.connections_opened)
+        return {
+            "started": self._client is not None,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "max_keepalive": self.max_keepalive,
+            "requests": self.requests,
+            "errors": self.errors,
+            "connections_opened": self.connections_opened,
+            "connection_reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0,
+            "pool_connections": len(connections),
+            "pool_idle": idle,
+            "pool_active": len(connections) - idle,
+        }
+
+
+upstream = UpstreamClient()
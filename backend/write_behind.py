@@ -0,0 +1,182 @@
+"""Write-behind buffering for append-only collections.
+
+Requests hand documents to a WriteBehindBuffer and return without waiting on
+Mongo; a background task flushes them with one unordered ``insert_many`` when
+a batch fills up or the flush interval passes. The queue is bounded: when it
+is full, writers wait for the next flush (backpressure) and give up with
+BufferFull after WRITE_BEHIND_MAX_WAIT seconds. Batches that fail with a
+connection error are put back and retried; shutdown flushes everything left.
+
+Optionally, documents with the same dedupe key within a short window are
+dropped, so repeat searches for one city do not pile up in search_history.
+"""
+import time
+import asyncio
+import logging
+from collections import deque
+
+from pymongo.errors import BulkWriteError
+
+from settings import env_float, env_int
+from metrics import observe_mongo
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class BufferFull(Exception):
+    pass
+
+
+class WriteBehindBuffer:
+    def __init__(self, collection, name: str, dedupe_key=None, dedupe_window: float = 0.0):
+        self.collection = collection
+        self.name = name
+        self.batch_size = env_int("WRITE_BEHIND_BATCH", 100)
+        self.interval = env_float("WRITE_BEHIND_INTERVAL", 1.0)
+        self.max_queue = env_int("WRITE_BEHIND_MAX_QUEUE", 10000)
+        self.max_wait = env_float("WRITE_BEHIND_MAX_WAIT", 5.0)
+        self.retry_backoff = env_float("WRITE_BEHIND_RETRY_BACKOFF", 2.0)
+        self.dedupe_key = dedupe_key
+        self.dedupe_window = dedupe_window
+        self._queue = deque()
+        self._inflight = []
+        self._recent = {}
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._task = None
+        self.accepted = 0
+        self.deduplicated = 0
+        self.written = 0
+        self.batches = 0
+        self.errors = 0
+        self.dropped = 0
+        self.backpressure_waits = 0
+        self.rejected = 0
+
+    @property
+    def deduplicating(self) -> bool:
+        return self.dedupe_key is not None and self.dedupe_window > 0
+
+    def _is_repeat(self, doc: dict) -> bool:
+        last = self._recent.get(self.dedupe_key(doc))
+        return last is not None and time.monotonic() - last < self.dedupe_window
+
+    def _remember(self, doc: dict):
+        now = time.monotonic()
+        self._recent[self.dedupe_key(doc)] = now
+        if len(self._recent) > 2 * self.max_queue:
+            cutoff = now - self.dedupe_window
+            self._recent = {key: seen for key, seen in self._recent.items() if seen >= cutoff}
+
+    async def add(self, doc: dict) -> bool:
+        """Queue a document; returns False if it was dropped as a repeat"""
+        if self.deduplicating and self._is_repeat(doc):
+            self.deduplicated += 1
+            return False
+        if len(self._queue) >= self.max_queue:
+            self.backpressure_waits += 1
+            deadline = time.monotonic() + self.max_wait
+            while len(self._queue) >= self.max_queue:
+                self._space.clear()
+                self._wakeup.set()
+                try:
+                    await asyncio.wait_for(self._space.wait(), max(0.0, deadline - time.monotonic()))
+                except asyncio.TimeoutError:
+                    self.rejected += 1
+                    raise BufferFull(f"{self.name} write buffer is full")
+        self._queue.append(doc)
+        self.accepted += 1
+        if self.deduplicating:
+            self._remember(doc)
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def pending(self) -> list:
+        """Documents accepted but not yet written, newest first"""
+        docs = list(self._queue)[::-1] + self._inflight[::-1]
+        return [{key: value for key, value in doc.items() if key != "_id"} for doc in docs]
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Flush everything still queued; called on shutdown"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        attempts = 0
+        while self._queue and attempts < 3:
+            if not await self.flush():
+                attempts += 1
+                await asyncio.sleep(self.retry_backoff)
+        if self._queue:
+            self.dropped += len(self._queue)
+            logger.error(f"Dropping {len(self._queue)} unwritten {self.name} documents at shutdown")
+            self._queue.clear()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._queue:
+                if not await self.flush():
+                    await asyncio.sleep(self.retry_backoff)
+                    break
+                if len(self._queue) < self.batch_size:
+                    break
+
+    async def flush(self) -> bool:
+        """Write one batch; returns False if it has to be retried later"""
+        if not self._queue:
+            return True
+        batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+        self._inflight = batch
+        try:
+            await observe_mongo(self.name, "insert_many", self.collection.insert_many(batch, ordered=False))
+            self.written += len(batch)
+            self.batches += 1
+        except BulkWriteError as e:
+            # Duplicate keys come from a retried batch that had partly landed
+            failed = [error for error in e.details.get("writeErrors", []) if error.get("code") != DUPLICATE_KEY]
+            self.written += len(batch) - len(failed)
+            self.batches += 1
+            self.dropped += len(failed)
+            if failed:
+                self.errors += 1
+                logger.warning(f"{len(failed)} {self.name} documents rejected by Mongo: {failed[0].get('errmsg')}")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Flushing {len(batch)} {self.name} documents failed, will retry: {e!r}")
+            self._queue.extendleft(reversed(batch))
+            return False
+        except asyncio.CancelledError:
+            # Shutdown interrupted the write; stop() retries it (already written ids are duplicates)
+            self._queue.extendleft(reversed(batch))
+            raise
+        finally:
+            self._inflight = []
+        self._space.set()
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self._queue) + len(self._inflight),
+            "max_queue": self.max_queue,
+            "accepted": self.accepted,
+            "deduplicated": self.deduplicated,
+            "written": self.written,
+            "batches": self.batches,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "backpressure_waits": self.backpressure_waits,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,429 @@
+"""Throughput and latency benchmark for the weather API.
+
+Starts a stub OpenWeather server (with configurable latency and error
+injection) and the FastAPI app in child processes, drives every
+/api/weather/* route at the requested concurrency, and reports req/s,
+p50/p95/p99 latency and the upstream calls each route caused.
+
+    python backend_bench.py --requests 500 --concurrency 32 --mock-mongo
+    python backend_bench.py --save bench-main.json
+    python backend_bench.py --compare bench-main.json --tolerance 10
+
+Each route is driven against its own set of coordinates so upstream counts
+are not shared between routes. The SSE /weather/live route is long-lived and
+is not part of the run. Mongo is a local server (--mongo-url) or, with
+--mock-mongo, an in-memory mongomock_motor client (pip install mongomock-motor).
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import signal
+import asyncio
+import argparse
+import subprocess
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+
+CITY_QUERIES = ["London", "Paris", "Tokyo", "New York", "Sao Paulo", "Mumbai", "Berlin", "Lagos", "Sydney", "Toronto"]
+
+
+# Stub OpenWeather
+def make_stub_app(latency_ms: float, jitter_ms: float, error_rate: float, seed: int):
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse
+
+    app = FastAPI()
+    hits = {}
+    rng = random.Random(seed)
+
+    async def upstream_call(name: str):
+        hits[name] = hits.get(name, 0) + 1
+        delay = latency_ms + rng.uniform(-jitter_ms, jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if error_rate and rng.random() < error_rate:
+            return JSONResponse({"cod": 502, "message": "injected error"}, status_code=502)
+        return None
+
+    def observation(lat: float, lon: float, dt: int) -> dict:
+        temp = round(30 - abs(lat) / 3 + rng.uniform(-3, 3), 2)
+        return {
+            "coord": {"lat": lat, "lon": lon},
+            "weather": [{"id": 801, "main": "Clouds", "description": "few clouds", "icon": "02d"}],
+            "main": {
+                "temp": temp, "feels_like": temp - 1, "temp_min": temp - 2, "temp_max": temp + 2,
+                "pressure": 1012, "humidity": rng.randint(30, 95),
+            },
+            "visibility": 10000,
+            "wind": {"speed": round(rng.uniform(0, 12), 1), "deg": rng.randint(0, 359)},
+            "clouds": {"all": rng.randint(0, 100)},
+            "dt": dt,
+            "sys": {"country": "ZZ", "sunrise": dt - 21600, "sunset": dt + 21600},
+            "timezone": 0,
+            "name": "Benchville",
+        }
+
+    @app.get("/data/2.5/weather")
+    async def weather(lat: float, lon: float):
+        return await upstream_call("weather") or observation(lat, lon, int(time.time()))
+
+    @app.get("/data/2.5/forecast")
+    async def forecast(lat: float, lon: float):
+        error = await upstream_call("forecast")
+        if error:
+            return error
+        start = (int(time.time()) // 10800 + 1) * 10800
+        items = []
+        for i in range(40):
+            item = observation(lat, lon, start + i * 10800)
+            item["pop"] = round(rng.random(), 2)
+            if item["pop"] > 0.7:
+                item["rain"] = {"3h": round(rng.uniform(0, 12), 2)}
+            items.append(item)
+        return {"list": items, "city": {"name": "Benchville", "country": "ZZ", "timezone": 0}}
+
+    @app.get("/data/2.5/air_pollution")
+    async def air_pollution(lat: float, lon: float):
+        return await upstream_call("air_pollution") or {
+            "list": [{
+                "main": {"aqi": rng.randint(1, 5)},
+                "components": {"co": 201.9, "no2": 0.8, "o3": 68.7, "pm2_5": 0.5, "pm10": 0.5},
+                "dt": int(time.time()),
+            }]
+        }
+
+    @app.get("/geo/1.0/direct")
+    async def direct(q: str, limit: int = 5):
+        return await upstream_call("direct") or [
+            {"name": q.split(",")[0].title(), "lat": 10.0, "lon": 20.0, "country": "ZZ"}
+        ]
+
+    @app.get("/geo/1.0/reverse")
+    async def reverse(lat: float, lon: float, limit: int = 1):
+        return await upstream_call("reverse") or [{"name": "Benchville", "lat": lat, "lon": lon, "country": "ZZ"}]
+
+    @app.get("/__hits")
+    async def get_hits():
+        return hits
+
+    return app
+
+
+def serve_stub(args):
+    import uvicorn
+    app = make_stub_app(args.upstream_latency, args.upstream_jitter, args.error_rate, args.seed)
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def serve_app(args):
+    import uvicorn
+    if args.mock_mongo:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--mock-mongo needs mongomock-motor: pip install mongomock-motor")
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server
+    uvicorn.run(server.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+# Load generation
+def route_plan(locations: int, seed: int):
+    """(name, method, path, request kwargs factory) for every benchmarked route"""
+    plans = []
+
+    def coordinates(route_index: int):
+        # A separate coordinate set per route keeps their cache entries apart
+        rng = random.Random(seed * 1000 + route_index)
+        return [(round(rng.uniform(-60, 60), 2), round(rng.uniform(-180, 180), 2)) for _ in range(locations)]
+
+    def location_route(name, path, units=True):
+        points = coordinates(len(plans))
+
+        def kwargs(rng):
+            lat, lon = rng.choice(points)
+            params = {"lat": lat, "lon": lon}
+            if units:
+                params["units"] = "metric"
+            return {"params": params}
+        plans.append((name, "GET", path, kwargs))
+
+    plans.append(("geocode", "GET", "/api/weather/geocode", lambda rng: {"params": {"q": rng.choice(CITY_QUERIES)}}))
+    location_route("reverse-geocode", "/api/weather/reverse-geocode", units=False)
+    location_route("current", "/api/weather/current")
+    location_route("forecast", "/api/weather/forecast")
+    location_route("air-quality", "/api/weather/air-quality", units=False)
+    location_route("uv-index", "/api/weather/uv-index", units=False)
+    location_route("alerts", "/api/weather/alerts")
+    location_route("bundle", "/api/weather/bundle")
+
+    batch_points = coordinates(len(plans))
+    plans.append(("batch", "POST", "/api/weather/batch", lambda rng: {
+        "json": {"locations": [{"lat": lat, "lon": lon} for lat, lon in rng.sample(batch_points, min(10, len(batch_points)))]}
+    }))
+    plans.append(("history-save", "POST", "/api/weather/history", lambda rng: {
+        "params": {"city": rng.choice(CITY_QUERIES), "lat": 51.5, "lon": -0.12, "country": "GB"}
+    }))
+    plans.append(("history", "GET", "/api/weather/history", lambda rng: {"params": {"limit": 5}}))
+    return plans
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def upstream_hits(client: httpx.AsyncClient, stub_url: str) -> dict:
+    response = await client.get(f"{stub_url}/__hits")
+    return response.json()
+
+
+async def run_route(client, app_url: str, plan, requests: int, concurrency: int, seed: int) -> dict:
+    name, method, path, kwargs_for = plan
+    rng = random.Random(seed)
+    latencies = []
+    statuses = {}
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            kwargs = kwargs_for(rng)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, f"{app_url}{path}", **kwargs)
+                await response.aread()
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if not status.startswith(("2", "3")))
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+async def drive(args, app_url: str, stub_url: str) -> dict:
+    plans = route_plan(args.locations, args.seed)
+    if args.routes:
+        wanted = set(args.routes.split(","))
+        plans = [plan for plan in plans if plan[0] in wanted]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results = {}
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        for index, plan in enumerate(plans):
+            before = await upstream_hits(client, stub_url)
+            result = await run_route(client, app_url, plan, args.requests, args.concurrency, args.seed + index)
+            after = await upstream_hits(client, stub_url)
+            upstream = {key: after[key] - before.get(key, 0) for key in after if after[key] != before.get(key, 0)}
+            result["upstream_calls"] = sum(upstream.values())
+            result["upstream"] = upstream
+            results[plan[0]] = result
+    return results
+
+
+# Child processes
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn(role: str, port: int, args, env: dict) -> subprocess.Popen:
+    command = [
+        sys.executable, __file__, "--role", role, "--port", str(port),
+        "--upstream-latency", str(args.upstream_latency), "--upstream-jitter", str(args.upstream_jitter),
+        "--error-rate", str(args.error_rate), "--seed", str(args.seed),
+    ]
+    if args.mock_mongo:
+        command.append("--mock-mongo")
+    output = None if args.verbose else subprocess.DEVNULL
+    return subprocess.Popen(command, env=env, stdout=output, stderr=output)
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode} during startup (rerun with --verbose)")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout:.0f}s")
+
+
+def stop(process: subprocess.Popen):
+    if process.poll() is None:
+        process.send_signal(signal.SIGINT)  # lets uvicorn run the shutdown hooks
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+# Reporting
+def print_report(results: dict, baseline: dict = None):
+    header = f"{'route':<16}{'req':>7}{'err':>6}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'upstream':>10}"
+    if baseline:
+        header += f"{'Δ req/s':>10}{'Δ p95':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        line = (
+            f"{name:<16}{result['requests']:>7}{result['errors']:>6}{result['rps']:>10}"
+            f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}{result['upstream_calls']:>10}"
+        )
+        previous = (baseline or {}).get(name)
+        if previous:
+            line += f"{change(previous['rps'], result['rps']):>10}{change(previous['p95_ms'], result['p95_ms']):>9}"
+        print(line)
+
+
+def change(old: float, new: float) -> str:
+    if not old:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Routes whose throughput dropped or p95 grew by more than tolerance percent"""
+    found = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if previous["rps"] and (previous["rps"] - result["rps"]) / previous["rps"] * 100 > tolerance:
+            found.append(f"{name}: req/s {previous['rps']} -> {result['rps']}")
+        if previous["p95_ms"] and (result["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] * 100 > tolerance:
+            found.append(f"{name}: p95 {previous['p95_ms']}ms -> {result['p95_ms']}ms")
+    return found
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def run(args) -> int:
+    stub_port = free_port()
+    app_port = free_port()
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    env = dict(os.environ)
+    env.update({
+        "OPENWEATHER_BASE_URL": f"{stub_url}/data/2.5",
+        "OPENWEATHER_GEO_URL": f"{stub_url}/geo/1.0",
+        "OPENWEATHER_API_KEY": "bench",
+        "MONGO_URL": args.mongo_url,
+        "DB_NAME": args.db_name,
+    })
+    # The free-plan quota and refresh-ahead would dominate a synthetic run,
+    # and the driver is a single client that per-client rate limits would shed
+    env.setdefault("QUOTA_CALLS_PER_MINUTE", "0")
+    env.setdefault("PREFETCH_ENABLED", "false")
+    env.setdefault("ADMISSION_RATE", "0")
+
+    stub = spawn("stub", stub_port, args, env)
+    app = None
+    try:
+        app = spawn("app", app_port, args, env)
+        asyncio.run(wait_until_ready(f"{stub_url}/__hits", stub))
+        asyncio.run(wait_until_ready(f"{app_url}/api/", app))
+        results = asyncio.run(drive(args, app_url, stub_url))
+    finally:
+        if app is not None:
+            stop(app)
+        stop(stub)
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["routes"]
+    print_report(results, baseline)
+
+    if args.save:
+        report = {
+            "commit": current_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "settings": {
+                key: getattr(args, key)
+                for key in ("requests", "concurrency", "locations", "upstream_latency", "upstream_jitter", "error_rate", "seed")
+            },
+            "routes": results,
+        }
+        Path(args.save).write_text(json.dumps(report, indent=2))
+        print(f"\nSaved baseline to {args.save}")
+
+    if baseline:
+        found = regressions(results, baseline, args.tolerance)
+        if found:
+            print(f"\n❌ Regressions beyond {args.tolerance}%:")
+            for line in found:
+                print(f"   - {line}")
+            return 1
+        print(f"\n✅ No regressions beyond {args.tolerance}%")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the weather API against a stub OpenWeather")
+    parser.add_argument("--requests", type=int, default=500, help="requests per route")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--locations", type=int, default=50, help="distinct coordinates per route")
+    parser.add_argument("--routes", help="comma-separated subset of routes to run")
+    parser.add_argument("--upstream-latency", type=float, default=50.0, help="stub latency in ms")
+    parser.add_argument("--upstream-jitter", type=float, default=10.0, help="stub latency jitter in ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stub calls failing with 502")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="weather_bench")
+    parser.add_argument("--mock-mongo", action="store_true", help="use an in-memory mongomock_motor client")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout per request in seconds")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show stub and app server logs")
+    parser.add_argument("--save", help="write results to this JSON baseline file")
+    parser.add_argument("--compare", help="compare against a saved JSON baseline")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="allowed regression in percent")
+    parser.add_argument("--role", choices=("driver", "stub", "app"), default="driver", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == "stub":
+        serve_stub(args)
+        return 0
+    if args.role == "app":
+        serve_app(args)
+        return 0
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -80,6 +80,9 @@ class WeatherAPITester:
             data={"client_name": "test_client"}
         )
 
+        # Test Prometheus metrics endpoint
+        self.run_test("Metrics", "GET", "metrics", 200)
+
     def test_geocoding_endpoints(self):
         """Test geocoding endpoints"""
         print("\n=== Testing Geocoding Endpoints ===")
@@ -159,6 +162,30 @@ class WeatherAPITester:
             200,
             params={"lat": lat, "lon": lon, "units": "metric"}
         )
+        
+        # Test combined bundle
+        success, data = self.run_test(
+            "Weather Bundle", 
+            "GET", 
+            "weather/bundle", 
+            200,
+            params={"lat": lat, "lon": lon, "units": "metric"}
+        )
+        if success and data.get("errors"):
+            print(f"   Bundle section errors: {data['errors']}")
+        
+        # Test multi-location batch (NDJSON stream)
+        self.run_test(
+            "Weather Batch", 
+            "POST", 
+            "weather/batch", 
+            200,
+            data={
+                "locations": [{"lat": lat, "lon": lon}, {"lat": 48.8566, "lon": 2.3522}],
+                "sections": ["current", "forecast"],
+                "units": "metric"
+            }
+        )
 
     def test_history_endpoints(self):
         """Test search history endpoints"""
@@ -13,6 +13,7 @@ export const CurrentWeather = () => {
 
     const tempUnit = units === 'metric' ? '°C' : '°F';
     const speedUnit = units === 'metric' ? 'm/s' : 'mph';
+    const distanceUnit = units === 'imperial' ? 'mi' : 'km';
 
     const formatTime = (timestamp) => {
         return new Date(timestamp * 1000).toLocaleTimeString([], { 
@@ -111,7 +112,7 @@ export const CurrentWeather = () => {
                 <WeatherDetail 
                     icon={<Eye className="h-5 w-5 text-purple-400" />}
                     label="Visibility"
-                    value={`${currentWeather.visibility} km`}
+                    value={`${currentWeather.visibility} ${distanceUnit}`}
                     testId="visibility-value"
                 />
                 <WeatherDetail 
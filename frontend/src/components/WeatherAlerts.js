@@ -10,10 +10,15 @@ const alertIcons = {
     thunderstorm: CloudLightning,
     thunderstorm_forecast: CloudLightning,
     rain: CloudRain,
+    rain_forecast: CloudRain,
     snow: Snowflake,
+    snow_forecast: Snowflake,
     wind: Wind,
+    wind_forecast: Wind,
     heat: Thermometer,
+    heat_forecast: Thermometer,
     cold: Thermometer,
+    cold_forecast: Thermometer,
     fog: CloudFog
 };
 
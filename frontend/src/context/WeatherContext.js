@@ -1,4 +1,4 @@
-import { createContext, useContext, useState, useCallback } from 'react';
+import { createContext, useContext, useState, useCallback, useEffect } from 'react';
 import axios from 'axios';
 import { toast } from 'sonner';
 
@@ -33,23 +33,25 @@ export const WeatherProvider = ({ children }) => {
         setError(null);
 
         try {
-            // Fetch all data in parallel
-            const [currentRes, forecastRes, aqiRes, uvRes, alertsRes] = await Promise.all([
-                axios.get(`${API}/weather/current`, { params: { lat, lon, units } }),
-                axios.get(`${API}/weather/forecast`, { params: { lat, lon, units } }),
-                axios.get(`${API}/weather/air-quality`, { params: { lat, lon } }),
-                axios.get(`${API}/weather/uv-index`, { params: { lat, lon } }),
-                axios.get(`${API}/weather/alerts`, { params: { lat, lon, units } })
-            ]);
-
-            setCurrentWeather(currentRes.data);
-            setForecast(forecastRes.data);
-            setAirQuality(aqiRes.data);
-            setUvIndex(uvRes.data);
-            setAlerts(alertsRes.data);
-
-            const name = cityName || currentRes.data.name;
-            const countryCode = country || currentRes.data.country;
+            // Fetch every section in one round-trip
+            const bundleRes = await axios.get(`${API}/weather/bundle`, { params: { lat, lon, units } });
+            const bundle = bundleRes.data;
+
+            if (!bundle.current) {
+                const detail = bundle.errors?.current?.detail || 'Failed to fetch weather data';
+                setError(detail);
+                toast.error('Error', { description: detail });
+                return;
+            }
+
+            setCurrentWeather(bundle.current);
+            setForecast(bundle.forecast);
+            setAirQuality(bundle.air_quality);
+            setUvIndex(bundle.uv_index);
+            setAlerts(bundle.alerts);
+
+            const name = cityName || bundle.current.name;
+            const countryCode = country || bundle.current.country;
             
             setLocation({
                 lat,
@@ -69,9 +71,9 @@ export const WeatherProvider = ({ children }) => {
             }
 
             // Show alerts if any warnings
-            if (alertsRes.data.has_warnings) {
+            if (bundle.alerts?.has_warnings) {
                 toast.warning('Weather Alert', {
-                    description: alertsRes.data.alerts[0]?.description || 'Check weather alerts for your area.'
+                    description: bundle.alerts.alerts[0]?.description || 'Check weather alerts for your area.'
                 });
             }
 
@@ -86,6 +88,40 @@ export const WeatherProvider = ({ children }) => {
         }
     }, [units]);
 
+    // Keep the current view fresh with server-pushed changes
+    useEffect(() => {
+        if (!location) return undefined;
+
+        const params = new URLSearchParams({ lat: location.lat, lon: location.lon, units });
+        const source = new EventSource(`${API}/weather/live?${params}`);
+        const setters = {
+            current: setCurrentWeather,
+            forecast: setForecast,
+            air_quality: setAirQuality,
+            uv_index: setUvIndex,
+            alerts: setAlerts
+        };
+
+        source.addEventListener('snapshot', (event) => {
+            const data = JSON.parse(event.data);
+            Object.entries(setters).forEach(([section, setSection]) => {
+                if (data[section]) setSection(data[section]);
+            });
+        });
+
+        // Updates only carry the fields that changed
+        source.addEventListener('update', (event) => {
+            const changes = JSON.parse(event.data);
+            Object.entries(changes).forEach(([section, value]) => {
+                const setSection = setters[section];
+                if (!setSection || !value) return;
+                setSection((prev) => (prev && !Array.isArray(value) ? { ...prev, ...value } : value));
+            });
+        });
+
+        return () => source.close();
+    }, [location, units]);
+
     // Search city by name
     const searchCity = async (query) => {
         try {
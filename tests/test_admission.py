@@ -0,0 +1,167 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from admission import AdmissionController  # noqa: E402
+
+
+@pytest.fixture
+def controller():
+    controller = AdmissionController()
+    controller.rate = 10.0
+    controller.burst = 2.0
+    controller.max_concurrency = 1
+    controller.max_queue = 2
+    controller.queue_slo = 1.0
+    controller.service_time = 0.01
+    return controller
+
+
+def scope(path="/api/weather/current", ip="10.0.0.1", headers=()):
+    return {"type": "http", "path": path, "headers": list(headers), "client": (ip, 1234)}
+
+
+def test_exempt_and_non_api_paths(controller):
+    assert controller.applies_to(scope())
+    assert not controller.applies_to(scope("/api/metrics"))
+    assert not controller.applies_to(scope("/static/app.js"))
+
+
+def test_clients_are_keyed_by_ip_unless_the_key_is_allowed(controller):
+    keyed = scope(headers=[(b"x-api-key", b"partner")])
+    assert controller.client_key(keyed) == "ip:10.0.0.1"
+    controller.api_keys = {b"partner"}
+    assert controller.client_key(keyed) == "key:partner"
+    assert controller.client_key(scope(headers=[(b"x-api-key", b"random")])) == "ip:10.0.0.1"
+
+
+def test_bucket_allows_burst_then_limits(controller):
+    assert controller.take_token("ip:a") == 0
+    assert controller.take_token("ip:a") == 0
+    wait = controller.take_token("ip:a")
+    assert 0 < wait <= 0.1
+    assert controller.take_token("ip:b") == 0  # other clients have their own bucket
+
+
+def test_bucket_refills_over_time(controller):
+    controller.take_token("ip:a")
+    controller.take_token("ip:a")
+    bucket = controller._buckets["ip:a"]
+    bucket.updated -= 0.1  # one token's worth at 10/s
+    assert controller.take_token("ip:a") == 0
+
+
+def test_least_recent_client_is_evicted(controller):
+    controller.max_clients = 2
+    for key in ("ip:a", "ip:b", "ip:a", "ip:c"):
+        controller.take_token(key)
+    assert list(controller._buckets) == ["ip:a", "ip:c"]
+
+
+def test_zero_rate_disables_client_limit(controller):
+    controller.rate = 0
+    assert all(controller.take_token("ip:a") == 0 for _ in range(100))
+    assert not controller._buckets
+
+
+def test_release_hands_the_slot_to_the_next_waiter(controller):
+    async def main():
+        assert await controller.acquire() is None
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        controller.release(0.01)
+        assert await waiter is None
+        assert controller.in_flight == 1  # the slot changed hands
+        controller.release(0.01)
+        assert controller.in_flight == 0
+
+    asyncio.run(main())
+    assert controller.queued == 1
+    assert controller.admitted == 2
+
+
+def test_waiters_are_served_in_order(controller):
+    order = []
+
+    async def wait(name):
+        await controller.acquire()
+        order.append(name)
+
+    async def main():
+        await controller.acquire()
+        waiters = [asyncio.ensure_future(wait(name)) for name in ("first", "second")]
+        await asyncio.sleep(0)
+        controller.release(0.01)
+        await asyncio.sleep(0)
+        controller.release(0.01)
+        await asyncio.gather(*waiters)
+
+    asyncio.run(main())
+    assert order == ["first", "second"]
+
+
+def test_cancelled_waiter_is_skipped(controller):
+    async def main():
+        await controller.acquire()
+        gone = asyncio.ensure_future(controller.acquire())
+        waiter = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.sleep(0)
+        controller.release(0.01)
+        assert await waiter is None
+        assert controller.in_flight == 1
+
+    asyncio.run(main())
+
+
+def test_full_queue_is_shed(controller):
+    async def main():
+        await controller.acquire()
+        waiters = [asyncio.ensure_future(controller.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert await controller.acquire() == "queue_full"
+        for waiter in waiters:
+            waiter.cancel()
+
+    asyncio.run(main())
+
+
+def test_predicted_wait_over_slo_is_shed(controller):
+    controller.service_time = 5.0
+
+    async def main():
+        await controller.acquire()
+        assert await controller.acquire() == "predicted_slo"
+
+    asyncio.run(main())
+
+
+def test_waiting_past_slo_is_shed(controller):
+    controller.queue_slo = 0.05
+
+    async def main():
+        await controller.acquire()
+        assert await controller.acquire() == "queue_timeout"
+        assert not controller._waiters
+        controller.release(0.01)
+        assert controller.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_zero_concurrency_disables_the_limit(controller):
+    controller.max_concurrency = 0
+
+    async def main():
+        for _ in range(10):
+            assert await controller.acquire() is None
+        controller.release(0.01)
+
+    asyncio.run(main())
+    assert controller.in_flight == 0
@@ -0,0 +1,134 @@
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker  # noqa: E402
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker("forecast", failure_threshold=3, slow_call=1.0, open_seconds=30.0)
+
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow()
+        breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+
+
+def half_open(breaker):
+    trip(breaker)
+    breaker.opened_at = time.monotonic() - breaker.open_seconds
+
+
+def test_opens_after_consecutive_failures(breaker):
+    breaker.record(False, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.state == CLOSED
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_success_resets_failure_count(breaker):
+    breaker.record(False, 0.1)
+    breaker.record(False, 0.1)
+    breaker.record(True, 0.1)
+    breaker.record(False, 0.1)
+    assert breaker.state == CLOSED
+    assert breaker.failures == 1
+
+
+def test_slow_success_counts_as_failure(breaker):
+    for _ in range(3):
+        breaker.record(True, 2.0)
+    assert breaker.state == OPEN
+
+
+def test_half_open_lets_one_probe_through(breaker):
+    half_open(breaker)
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_successful_probe_closes(breaker):
+    half_open(breaker)
+    assert breaker.allow()
+    breaker.record(True, 0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens(breaker):
+    half_open(breaker)
+    assert breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+    assert not breaker.allow()
+
+
+def test_abandoned_probe_lets_another_through(breaker):
+    half_open(breaker)
+    assert breaker.allow()
+    breaker.abandon()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+
+
+def test_unsettled_probe_blocks_until_recorded(breaker):
+    # A probe that neither records nor abandons keeps every later call out,
+    # which is why every exit path of an upstream call must settle the breaker
+    half_open(breaker)
+    assert breaker.allow()
+    for _ in range(5):
+        assert not breaker.allow()
+    breaker.record(False, 0.1)
+    assert breaker.state == OPEN
+
+
+def test_abandon_outside_half_open_is_a_no_op(breaker):
+    breaker.abandon()
+    assert breaker.state == CLOSED
+    trip(breaker)
+    breaker.abandon()
+    assert breaker.state == OPEN
+
+
+@pytest.fixture
+def server(monkeypatch):
+    pytest.importorskip("motor")
+    monkeypatch.setenv("MONGO_URL", "mongodb://localhost:27017")
+    monkeypatch.setenv("DB_NAME", "test_breaker")
+    monkeypatch.setenv("QUOTA_CALLS_PER_MINUTE", "0")
+    import server
+    return server
+
+
+def test_undecodable_probe_reopens_the_breaker(server, monkeypatch):
+    import asyncio
+    import httpx
+    from fastapi import HTTPException
+
+    endpoint = f"{server.OPENWEATHER_BASE_URL}/weather"
+    breaker = server.upstream_breakers.get(endpoint)
+    half_open(breaker)
+
+    async def maintenance_page(endpoint, params, budget=None):
+        return httpx.Response(200, text="<html>Down for maintenance</html>",
+                              request=httpx.Request("GET", endpoint))
+
+    monkeypatch.setattr(server.upstream, "get", maintenance_page)
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.fetch_openweather_upstream(endpoint, {"lat": 1, "lon": 2}))
+    assert error.value.status_code == 502
+    assert breaker.state == OPEN
+    assert not breaker.probing
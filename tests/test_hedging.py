@@ -0,0 +1,101 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from hedging import Hedger  # noqa: E402
+
+
+@pytest.fixture
+def hedger():
+    hedger = Hedger()
+    hedger.enabled = True
+    hedger.min_samples = 1
+    hedger.min_delay = 0.01
+    hedger.observe("forecast", 0.01)
+    return hedger
+
+
+def usable(status):
+    return status < 500 and status != 429
+
+
+def calls(*replies):
+    """call() whose n-th invocation answers replies[n] = (delay, status or exception)"""
+    started = []
+
+    async def call():
+        delay, result = replies[len(started)]
+        started.append(result)
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return call, started
+
+
+async def paid():
+    return True
+
+
+def run(hedger, call, **kwargs):
+    return asyncio.run(hedger.run("forecast", call, paid, **kwargs))
+
+
+def test_fast_call_is_not_hedged(hedger):
+    call, started = calls((0, 200))
+    assert run(hedger, call, usable=usable) == 200
+    assert len(started) == 1
+    assert hedger.sent == 0
+
+
+def test_hedge_wins_against_slow_call(hedger):
+    call, started = calls((0.3, 200), (0.01, 200))
+    assert run(hedger, call, usable=usable) == 200
+    assert len(started) == 2
+    assert hedger.sent == 1
+    assert hedger.won == 1
+
+
+def test_fast_error_does_not_beat_good_answer(hedger):
+    call, _ = calls((0.3, 200), (0.01, 503))
+    assert run(hedger, call, usable=usable) == 200
+    assert hedger.won == 0
+
+
+def test_fast_rate_limit_does_not_beat_good_answer(hedger):
+    call, _ = calls((0.05, 429), (0.3, 200))
+    assert run(hedger, call, usable=usable) == 200
+    assert hedger.won == 1
+
+
+def test_error_answer_returned_when_both_fail(hedger):
+    call, _ = calls((0.05, 503), (0.1, ConnectionError("reset")))
+    assert run(hedger, call, usable=usable) == 503
+
+
+def test_exception_raised_when_both_raise(hedger):
+    call, _ = calls((0.05, ConnectionError("first")), (0.1, ConnectionError("second")))
+    with pytest.raises(ConnectionError, match="first"):
+        run(hedger, call, usable=usable)
+
+
+def test_unpaid_hedge_is_skipped(hedger):
+    call, started = calls((0.05, 200))
+
+    async def no_quota():
+        return False
+
+    assert asyncio.run(hedger.run("forecast", call, no_quota)) == 200
+    assert len(started) == 1
+    assert hedger.skipped == 1
+
+
+def test_no_hedge_past_the_deadline(hedger):
+    call, started = calls((0.05, 200))
+    assert run(hedger, call, time_left=0.005) == 200
+    assert len(started) == 1
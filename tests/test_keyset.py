@@ -0,0 +1,97 @@
+import sys
+import json
+import asyncio
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from keyset import InvalidCursor, Page, decode_cursor, encode_cursor, sort_key  # noqa: E402
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def serialize(doc: dict) -> bytes:
+    return json.dumps(doc, default=str).encode()
+
+
+def status(n: int, timestamp=None) -> dict:
+    return {"id": f"{n:03d}", "client_name": f"client {n}", "timestamp": timestamp or START + timedelta(seconds=n)}
+
+
+@pytest.fixture
+def collection():
+    return mongomock_motor.AsyncMongoMockClient(tz_aware=True)["test"]["status_checks"]
+
+
+def insert(collection, docs):
+    asyncio.run(collection.insert_many([dict(doc) for doc in docs]))
+
+
+async def _pages(collection, pending, limit):
+    pages = []
+    cursor = None
+    while True:
+        page = Page(collection, pending, cursor, limit, serialize)
+        await page.prepare()
+        body = b"".join([chunk async for chunk in page.body()])
+        pages.append([doc["id"] for doc in json.loads(body)])
+        cursor = page.next_cursor
+        if cursor is None:
+            return pages
+
+
+def pages(collection, pending=(), limit=3):
+    return asyncio.run(_pages(collection, list(pending), limit))
+
+
+def test_cursor_round_trip():
+    for key in (sort_key(status(7)), sort_key(status(8, "2024-01-01T00:00:00+00:00"))):
+        assert decode_cursor(encode_cursor(key)) == key
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "e30", encode_cursor((True, START, "1"))[:-4]])
+def test_invalid_cursor(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def test_pages_newest_first_without_gaps(collection):
+    insert(collection, [status(n) for n in range(8)])
+    assert pages(collection) == [["007", "006", "005"], ["004", "003", "002"], ["001", "000"]]
+
+
+def test_exact_multiple_has_no_empty_trailing_page(collection):
+    insert(collection, [status(n) for n in range(6)])
+    assert pages(collection) == [["005", "004", "003"], ["002", "001", "000"]]
+
+
+def test_empty_listing(collection):
+    assert pages(collection) == [[]]
+
+
+def test_equal_timestamps_are_ordered_by_id(collection):
+    insert(collection, [status(n, START) for n in range(5)])
+    assert pages(collection, limit=2) == [["004", "003"], ["002", "001"], ["000"]]
+
+
+def test_buffered_documents_are_merged_in_order(collection):
+    insert(collection, [status(n) for n in range(0, 8, 2)])
+    pending = [status(n) for n in (7, 5, 3, 1)]
+    assert pages(collection, pending) == [["007", "006", "005"], ["004", "003", "002"], ["001", "000"]]
+
+
+def test_document_both_buffered_and_stored_is_listed_once(collection):
+    # A batch that is being flushed can already be in Mongo while still pending
+    insert(collection, [status(n) for n in range(4)])
+    assert pages(collection, [status(3), status(2)]) == [["003", "002", "001"], ["000"]]
+
+
+def test_legacy_string_timestamps_come_last(collection):
+    insert(collection, [status(n) for n in range(3)])
+    insert(collection, [status(n, f"2025-06-0{n - 2}T00:00:00+00:00") for n in range(3, 6)])
+    assert pages(collection, limit=2) == [["002", "001"], ["000", "005"], ["004", "003"]]
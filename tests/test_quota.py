@@ -0,0 +1,136 @@
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from quota import BACKGROUND, BULK, INTERACTIVE, QuotaExceeded, UpstreamQuota  # noqa: E402
+
+
+@pytest.fixture
+def quota():
+    quota = UpstreamQuota()
+    quota.calls_per_minute = 1200  # a token every 50 ms
+    quota.burst = 2.0
+    quota.background_reserve = 1.0
+    quota.max_wait = (2.0, 2.0, 0.0)
+    quota.max_queue = (10, 10, 0)
+    quota.tokens = quota.burst
+    quota._updated = time.monotonic()
+    return quota
+
+
+def empty(quota):
+    quota.tokens = 0.0
+    quota._updated = time.monotonic()
+
+
+def test_disabled_quota_admits_everything(quota):
+    quota.calls_per_minute = 0
+    empty(quota)
+    for _ in range(100):
+        asyncio.run(quota.acquire(BACKGROUND))
+
+
+def test_burst_is_admitted_without_waiting(quota):
+    async def burst():
+        await quota.acquire()
+        await quota.acquire()
+
+    asyncio.run(burst())
+    assert quota.stats_by_priority[INTERACTIVE].admitted == 2
+    assert quota.stats_by_priority[INTERACTIVE].waited == 0
+
+
+def test_empty_bucket_queues_until_refill(quota):
+    empty(quota)
+    started = time.monotonic()
+    asyncio.run(quota.acquire(INTERACTIVE))
+    assert 0.03 < time.monotonic() - started < 0.5
+    assert quota.stats_by_priority[INTERACTIVE].waited == 1
+
+
+def test_background_stays_out_of_the_reserve(quota):
+    quota.tokens = 1.5  # enough for a user request, not above the reserve
+    with pytest.raises(QuotaExceeded) as error:
+        asyncio.run(quota.acquire(BACKGROUND))
+    assert error.value.priority == BACKGROUND
+    assert error.value.retry_after >= 1
+    assert quota.stats_by_priority[BACKGROUND].dropped == 1
+    asyncio.run(quota.acquire(INTERACTIVE))
+
+
+def test_background_is_admitted_above_the_reserve(quota):
+    asyncio.run(quota.acquire(BACKGROUND))
+    assert quota.stats_by_priority[BACKGROUND].admitted == 1
+
+
+def test_higher_priority_is_served_first(quota):
+    empty(quota)
+    order = []
+
+    async def acquire(priority, name):
+        await quota.acquire(priority)
+        order.append(name)
+
+    async def main():
+        bulk = [asyncio.ensure_future(acquire(BULK, f"bulk{n}")) for n in range(2)]
+        await asyncio.sleep(0)
+        interactive = [asyncio.ensure_future(acquire(INTERACTIVE, f"interactive{n}")) for n in range(2)]
+        await asyncio.gather(*bulk, *interactive)
+
+    asyncio.run(main())
+    assert order == ["interactive0", "interactive1", "bulk0", "bulk1"]
+
+
+def test_new_request_does_not_jump_the_queue(quota):
+    # A token that refills while callers wait goes to them, not to a newcomer
+    quota.tokens = 0.99
+    order = []
+
+    async def acquire(name):
+        await quota.acquire(INTERACTIVE)
+        order.append(name)
+
+    async def main():
+        first = asyncio.ensure_future(acquire("queued"))
+        await asyncio.sleep(0.02)
+        await acquire("newcomer")
+        await first
+
+    asyncio.run(main())
+    assert order == ["queued", "newcomer"]
+
+
+def test_full_queue_is_rejected(quota):
+    quota.max_queue = (1, 10, 0)
+    empty(quota)
+
+    async def main():
+        waiting = asyncio.ensure_future(quota.acquire(INTERACTIVE))
+        await asyncio.sleep(0)
+        with pytest.raises(QuotaExceeded):
+            await quota.acquire(INTERACTIVE)
+        await waiting
+
+    asyncio.run(main())
+    assert quota.stats_by_priority[INTERACTIVE].dropped == 1
+
+
+def test_wait_longer_than_max_wait_is_rejected(quota):
+    quota.calls_per_minute = 6  # a token every 10 s
+    quota.max_wait = (0.05, 2.0, 0.0)
+    empty(quota)
+    with pytest.raises(QuotaExceeded):
+        asyncio.run(quota.acquire(INTERACTIVE))
+    assert quota.stats_by_priority[INTERACTIVE].dropped == 1
+
+
+def test_penalize_empties_the_bucket(quota):
+    quota.penalize()
+    assert quota.tokens <= 0
+    with pytest.raises(QuotaExceeded):
+        asyncio.run(quota.acquire(BACKGROUND))
@@ -0,0 +1,133 @@
+import sys
+import asyncio
+from pathlib import Path
+
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from write_behind import DUPLICATE_KEY, BufferFull, WriteBehindBuffer  # noqa: E402
+
+
+class Collection:
+    """insert_many records batches, or raises the queued failures first"""
+
+    def __init__(self, *failures):
+        self.failures = list(failures)
+        self.batches = []
+
+    async def insert_many(self, docs, ordered=True):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.batches.append([doc["id"] for doc in docs])
+
+
+def buffer(collection, **kwargs) -> WriteBehindBuffer:
+    buffer = WriteBehindBuffer(collection, "status_checks", **kwargs)
+    buffer.batch_size = 3
+    buffer.retry_backoff = 0.01
+    return buffer
+
+
+def add(buffer, *ids):
+    async def main():
+        return [await buffer.add({"id": doc_id, "city": "London"}) for doc_id in ids]
+
+    return asyncio.run(main())
+
+
+def test_flush_writes_one_batch_at_a_time():
+    collection = Collection()
+    writes = buffer(collection)
+    add(writes, *"abcde")
+    assert asyncio.run(writes.flush())
+    assert collection.batches == [["a", "b", "c"]]
+    assert [doc["id"] for doc in writes.pending()] == ["e", "d"]
+    assert asyncio.run(writes.flush())
+    assert collection.batches[-1] == ["d", "e"]
+    assert writes.written == 5
+    assert writes.batches == 2
+
+
+def test_failed_batch_is_put_back_in_order():
+    collection = Collection(AutoReconnect("primary stepped down"))
+    writes = buffer(collection)
+    add(writes, *"abcd")
+    assert not asyncio.run(writes.flush())
+    assert [doc["id"] for doc in writes.pending()] == ["d", "c", "b", "a"]
+    assert writes.errors == 1
+    assert asyncio.run(writes.flush())
+    assert collection.batches == [["a", "b", "c"]]
+
+
+def test_duplicates_from_a_retried_batch_count_as_written():
+    partly_landed = BulkWriteError({"writeErrors": [{"index": 0, "code": DUPLICATE_KEY, "errmsg": "dup"}]})
+    writes = buffer(Collection(partly_landed))
+    add(writes, *"ab")
+    assert asyncio.run(writes.flush())
+    assert writes.written == 2
+    assert writes.dropped == 0
+    assert writes.errors == 0
+
+
+def test_rejected_documents_are_dropped_not_retried():
+    rejected = BulkWriteError({"writeErrors": [{"index": 1, "code": 121, "errmsg": "validation failed"}]})
+    writes = buffer(Collection(rejected))
+    add(writes, *"ab")
+    assert asyncio.run(writes.flush())
+    assert writes.written == 1
+    assert writes.dropped == 1
+    assert not writes.pending()
+
+
+def test_repeats_within_the_window_are_dropped():
+    writes = buffer(Collection(), dedupe_key=lambda doc: doc["city"], dedupe_window=60)
+    assert add(writes, "a", "b") == [True, False]
+    assert writes.deduplicated == 1
+    assert [doc["id"] for doc in writes.pending()] == ["a"]
+
+
+def test_repeats_after_the_window_are_kept():
+    writes = buffer(Collection(), dedupe_key=lambda doc: doc["city"], dedupe_window=60)
+    add(writes, "a")
+    writes._recent["London"] -= 61
+    assert add(writes, "b") == [True]
+
+
+def test_full_buffer_rejects_after_max_wait():
+    writes = buffer(Collection())
+    writes.max_queue = 2
+    writes.max_wait = 0.05
+    add(writes, *"ab")
+    with pytest.raises(BufferFull):
+        add(writes, "c")
+    assert writes.backpressure_waits == 1
+    assert writes.rejected == 1
+
+
+def test_full_buffer_waits_for_a_flush():
+    collection = Collection()
+    writes = buffer(collection)
+    writes.max_queue = 2
+    writes.interval = 10
+
+    async def main():
+        writes.start()
+        await writes.add({"id": "a"})
+        await writes.add({"id": "b"})
+        await writes.add({"id": "c"})  # wakes the flusher and waits for room
+        await writes.stop()
+
+    asyncio.run(main())
+    assert collection.batches == [["a", "b"], ["c"]]
+    assert writes.rejected == 0
+
+
+def test_stop_flushes_everything_left():
+    collection = Collection(AutoReconnect("blip"))
+    writes = buffer(collection)
+    add(writes, *"abcd")
+    asyncio.run(writes.stop())
+    assert collection.batches == [["a", "b", "c"], ["d"]]
+    assert writes.dropped == 0